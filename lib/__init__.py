@@ -1,4 +1,6 @@
 from .sagemaker_processing import run
-from .aws import download_file, list_files, generate_presigned_url, send_discord_notification, list_files_paginated, extract_first_frame
+from .aws import download_file, list_files, generate_presigned_url, send_discord_notification, list_files_paginated, extract_first_frame, get_client, get_session, client_stats, get_listing_index, list_files_indexed, iter_objects, iter_files, iter_common_prefixes, newest_objects
+from .db import get_engine, upsert_rows, upsert_row_to_db, fetch_processing_page
+from .presign import presign, presign_many, presign_s3_uris, presign_stats
 
-__all__ = ["run", "download_file", "list_files", "generate_presigned_url", "send_discord_notification", "list_files_paginated", "extract_first_frame"]
+__all__ = ["run", "download_file", "list_files", "generate_presigned_url", "send_discord_notification", "list_files_paginated", "extract_first_frame", "get_client", "get_session", "client_stats", "get_listing_index", "list_files_indexed", "iter_objects", "iter_files", "iter_common_prefixes", "newest_objects", "get_engine", "upsert_rows", "upsert_row_to_db", "fetch_processing_page", "presign", "presign_many", "presign_s3_uris", "presign_stats"]
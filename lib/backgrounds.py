@@ -0,0 +1,107 @@
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+import streamlit
+
+from .aws import get_client, get_listing_index
+from .presign import presign_many
+
+logger = logging.getLogger(streamlit.__name__)
+
+# Jobs write their median-frame PNGs into their output prefix. Only this
+# prefix is indexed, so the listing covers job outputs and not the whole bucket.
+BACKGROUND_PREFIX = os.getenv("BACKGROUND_PREFIX", "outputs/")
+# Thumbnails go under a prefix the background index doesn't cover
+THUMBNAIL_PREFIX = "thumbnails/"
+THUMBNAIL_WIDTH = 320
+THUMBNAIL_WORKERS = 8
+# Full-resolution backgrounds kept in memory, by total size
+IMAGE_CACHE_MAX_BYTES = int(os.getenv("BACKGROUND_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+
+_images = OrderedDict()
+_images_bytes = 0
+_images_lock = threading.Lock()
+
+
+def thumbnail_key_for(entry):
+    """S3 key of the thumbnail for a background listing entry.
+
+    The ETag is part of the key, so an overwritten background gets a new
+    thumbnail, and whether one exists can be read from the thumbnail listing.
+    """
+    return f"{THUMBNAIL_PREFIX}{entry['Key'].rsplit('.', 1)[0]}-{entry['ETag']}.jpg"
+
+
+def background_index(bucket, force_refresh=False, prefix=BACKGROUND_PREFIX):
+    """Return the background PNGs under ``prefix``, newest first, from the shared listing index."""
+    if THUMBNAIL_PREFIX.startswith(prefix):
+        raise ValueError(f"Background prefix {prefix!r} must not contain the thumbnails under {THUMBNAIL_PREFIX!r}")
+    entries = get_listing_index(bucket, prefix).entries(force_refresh=force_refresh)
+    backgrounds = [entry for entry in entries if entry["Key"].lower().endswith(".png")]
+    return sorted(backgrounds, key=lambda entry: entry["LastModified"], reverse=True)
+
+
+def get_background(bucket, entry):
+    """Return the PNG bytes of a background, from memory when it was fetched before."""
+    global _images_bytes
+    cache_key = (bucket, entry["Key"], entry["ETag"])
+    with _images_lock:
+        data = _images.get(cache_key)
+        if data is not None:
+            _images.move_to_end(cache_key)
+            return data
+
+    data = get_client("s3").get_object(Bucket=bucket, Key=entry["Key"])["Body"].read()
+    with _images_lock:
+        if cache_key not in _images:
+            _images[cache_key] = data
+            _images_bytes += len(data)
+        while _images_bytes > IMAGE_CACHE_MAX_BYTES and len(_images) > 1:
+            _, evicted = _images.popitem(last=False)
+            _images_bytes -= len(evicted)
+    return data
+
+
+def _make_thumbnail(bucket, entry):
+    image = cv2.imdecode(np.frombuffer(get_background(bucket, entry), dtype=np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        raise ValueError(f"Could not decode {entry['Key']}")
+    height, width = image.shape[:2]
+    if width > THUMBNAIL_WIDTH:
+        image = cv2.resize(image, (THUMBNAIL_WIDTH, round(height * THUMBNAIL_WIDTH / width)), interpolation=cv2.INTER_AREA)
+    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 85])
+    if not ok:
+        raise ValueError(f"Could not encode thumbnail for {entry['Key']}")
+    key = thumbnail_key_for(entry)
+    response = get_client("s3").put_object(Bucket=bucket, Key=key, Body=encoded.tobytes(), ContentType="image/jpeg")
+    get_listing_index(bucket, THUMBNAIL_PREFIX).add(key, encoded.size, response.get("ETag"))
+
+
+def thumbnail_urls(bucket, entries):
+    """Return presigned thumbnail URLs for ``entries``, generating missing thumbnails first.
+
+    Thumbnails are made once, in parallel, and stored under ``thumbnails/``;
+    after that the browser fetches them straight from S3. Entries whose
+    thumbnail can't be made get None.
+    """
+    existing = {entry["Key"] for entry in get_listing_index(bucket, THUMBNAIL_PREFIX).entries()}
+    missing = [entry for entry in entries if thumbnail_key_for(entry) not in existing]
+
+    failed = set()
+    if missing:
+        with ThreadPoolExecutor(max_workers=THUMBNAIL_WORKERS) as pool:
+            futures = {pool.submit(_make_thumbnail, bucket, entry): entry for entry in missing}
+        for future, entry in futures.items():
+            try:
+                future.result()
+            except Exception as e:
+                logger.error(f"Thumbnail for {entry['Key']} failed: {e}")
+                failed.add(entry["Key"])
+
+    urls = presign_many([(bucket, thumbnail_key_for(entry)) for entry in entries])
+    return [None if entry["Key"] in failed else url for entry, url in zip(entries, urls)]
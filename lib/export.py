@@ -0,0 +1,146 @@
+import datetime
+import importlib.util
+import io
+import logging
+import re
+import tempfile
+import zipfile
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import streamlit
+
+from .aws import get_listing_index
+from .multipart_upload import upload_fileobj_multipart
+from .presign import presign
+from .reports import build_display_table, load_report
+
+logger = logging.getLogger(streamlit.__name__)
+
+# Parquet needs one of pandas' optional engines, so it is only offered when one is installed
+PARQUET_AVAILABLE = any(importlib.util.find_spec(engine) for engine in ("pyarrow", "fastparquet"))
+EXPORT_FORMATS = ("Excel", "CSV", "Parquet") if PARQUET_AVAILABLE else ("Excel", "CSV")
+EXPORT_WORKERS = 8
+EXPORT_PREFIX = "exports/"
+# Archives stay in memory up to this size, then spill to a temporary file
+SPOOL_MAX_SIZE = 64 * 1024 * 1024
+EXPORT_LINK_EXPIRATION = 3600
+
+
+def select_reports(bucket, report_keys, start_date=None, end_date=None, prefix="outputs/"):
+    """Filter ``report_keys`` to reports last modified between ``start_date`` and ``end_date`` (inclusive dates)."""
+    if start_date is None and end_date is None:
+        return list(report_keys)
+    wanted = set(report_keys)
+    selected = []
+    for entry in get_listing_index(bucket, prefix).entries():
+        if entry["Key"] not in wanted:
+            continue
+        day = entry["LastModified"].date()
+        if (start_date is None or day >= start_date) and (end_date is None or day <= end_date):
+            selected.append(entry["Key"])
+    return selected
+
+
+def iter_reports(bucket, report_keys, max_workers=EXPORT_WORKERS):
+    """Fetch reports concurrently, yielding ``(key, counts, interval_minutes)`` as each completes.
+
+    At most ``2 * max_workers`` reports are in flight, so memory stays bounded
+    however many reports are exported.
+    """
+    keys = iter(report_keys)
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        pending = {}
+        for key in keys:
+            pending[pool.submit(load_report, bucket, key)] = key
+            if len(pending) >= 2 * max_workers:
+                break
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                key = pending.pop(future)
+                counts, interval_minutes = future.result()
+                yield key, counts, interval_minutes
+                next_key = next(keys, None)
+                if next_key is not None:
+                    pending[pool.submit(load_report, bucket, next_key)] = next_key
+
+
+def _report_name(key):
+    return key.split('/')[-1].rsplit('.', 1)[0]
+
+
+def _sheet_name(name, used):
+    """Excel sheet names: at most 31 characters, no []:*?/\\ and unique in the workbook."""
+    base = re.sub(r'[\[\]:*?/\\]', '_', name)[:31]
+    sheet, n = base, 1
+    while sheet in used:
+        suffix = f"~{n}"
+        sheet, n = base[:31 - len(suffix)] + suffix, n + 1
+    used.add(sheet)
+    return sheet
+
+
+def write_export(bucket, report_keys, export_format, fileobj, progress_callback=None):
+    """Write an export of ``report_keys`` to ``fileobj``.
+
+    Excel writes one sheet per report; CSV and Parquet write a zip with one
+    file per report (display tables for CSV, long counts for Parquet). Each
+    report is written as soon as it arrives and then dropped.
+    ``progress_callback(done, total)`` is called from the calling thread.
+    """
+    total = len(report_keys)
+    reports = iter_reports(bucket, report_keys)
+
+    if export_format == "Excel":
+        from openpyxl import Workbook
+
+        # Write-only sheets stream their rows to temporary files instead of
+        # keeping every cell of every sheet in memory until the save
+        workbook = Workbook(write_only=True)
+        used = set()
+        for done, (key, counts, interval_minutes) in enumerate(reports, 1):
+            table = build_display_table(counts, interval_minutes)
+            sheet = workbook.create_sheet(_sheet_name(_report_name(key), used))
+            sheet.append([str(column) for column in table.columns])
+            for row in table.itertuples(index=False):
+                sheet.append([value.item() if hasattr(value, "item") else value for value in row])
+            if progress_callback:
+                progress_callback(done, total)
+        if not used:
+            workbook.create_sheet("Reports")
+        workbook.save(fileobj)
+        return
+
+    with zipfile.ZipFile(fileobj, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for done, (key, counts, interval_minutes) in enumerate(reports, 1):
+            if export_format == "CSV":
+                archive.writestr(f"{_report_name(key)}.csv", build_display_table(counts, interval_minutes).to_csv(index=False))
+            elif export_format == "Parquet":
+                buffer = io.BytesIO()
+                counts.assign(interval_minutes=interval_minutes).to_parquet(buffer, index=False)
+                archive.writestr(f"{_report_name(key)}.parquet", buffer.getvalue())
+            else:
+                raise ValueError(f"Unknown export format {export_format}")
+            if progress_callback:
+                progress_callback(done, total)
+
+
+def export_reports(bucket, report_keys, export_format, progress_callback=None):
+    """Build an export archive and upload it under ``exports/``.
+
+    The archive is spooled (in memory up to ``SPOOL_MAX_SIZE``, then on a
+    temporary file) and uploaded with the multipart engine, so the browser
+    downloads it straight from S3. Returns a presigned download URL.
+    """
+    extension = {"Excel": "xlsx", "CSV": "zip", "Parquet": "zip"}[export_format]
+    datetime_str = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+    export_key = f"{EXPORT_PREFIX}traffmind_reports_{datetime_str}.{extension}"
+
+    with tempfile.SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as archive:
+        write_export(bucket, report_keys, export_format, archive, progress_callback)
+        size = archive.seek(0, 2)
+        archive.seek(0)
+        upload_fileobj_multipart(archive, bucket, export_key, size, resume=False)
+
+    logger.info(f"Exported {len(report_keys)} reports to s3://{bucket}/{export_key}")
+    return presign(bucket, export_key, EXPORT_LINK_EXPIRATION)
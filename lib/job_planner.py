@@ -0,0 +1,137 @@
+import logging
+import math
+import statistics
+import threading
+import time
+
+import streamlit
+
+from .db import get_engine
+
+logger = logging.getLogger(streamlit.__name__)
+
+# On-demand SageMaker Processing prices in us-east-2 (USD per hour)
+INSTANCE_PRICES = {
+    "ml.g4dn.8xlarge": 2.72,
+    "ml.p3.2xlarge": 3.825,
+}
+
+# Processed frames per hour assumed for an instance type until the processing
+# table has at least MIN_HISTORY_JOBS completed jobs on it.
+DEFAULT_FRAMES_PER_HOUR = {
+    "ml.g4dn.8xlarge": 36000,
+    "ml.p3.2xlarge": 45000,
+}
+MIN_HISTORY_JOBS = 3
+HISTORY_TTL_SECONDS = 3600
+
+# Used when the container index can't tell us the frame count (e.g. raw .h264)
+DEFAULT_FPS = 30
+DEFAULT_BYTES_PER_SECOND = 500_000
+
+MIN_VOLUME_GB = 30
+VOLUME_OVERHEAD_GB = 10
+MAX_VOLUME_GB = 16384
+
+RUNTIME_SAFETY_FACTOR = 2.0
+MIN_RUNTIME_SECONDS = 3600
+MAX_RUNTIME_SECONDS = 3600 * 24 * 5
+DEADLINE_HOURS = 18
+
+_history = None
+_history_loaded_at = 0.0
+_history_lock = threading.Lock()
+
+
+def load_throughput_history():
+    """Return ``{machine: median processed frames per hour}`` from completed jobs.
+
+    Read from the ``Machine``, ``Duration (hrs)``, ``Number_of_Frames`` and
+    ``Every`` columns of the processing table and cached for an hour. Returns
+    an empty dict if the table can't be read.
+    """
+    global _history, _history_loaded_at
+    from sqlalchemy import text
+
+    with _history_lock:
+        if _history is not None and time.time() - _history_loaded_at < HISTORY_TTL_SECONDS:
+            return _history
+
+        query = """
+        SELECT "Machine", "Duration (hrs)", "Number_of_Frames", "Every"
+        FROM processing
+        WHERE "Status" = 'Completed' AND "Number_of_Frames" > 0 AND "Duration (hrs)" > 0;
+        """
+        samples = {}
+        try:
+            with get_engine().connect() as connection:
+                for machine, duration_hrs, frames, every in connection.execute(text(query)):
+                    processed = float(frames) / max(int(every or 1), 1)
+                    samples.setdefault(machine, []).append(processed / float(duration_hrs))
+        except Exception as e:
+            logger.warning(f"Could not load processing history: {e}")
+            return _history or {}
+
+        _history = {
+            machine: statistics.median(rates)
+            for machine, rates in samples.items() if len(rates) >= MIN_HISTORY_JOBS
+        }
+        _history_loaded_at = time.time()
+        return _history
+
+
+def estimate_frames(video_info):
+    """Estimate the total number of frames in a video from ``lib.video.probe_video`` output."""
+    if video_info.get("frames"):
+        return video_info["frames"]
+    duration_s = video_info.get("duration_s") or video_info["size"] / DEFAULT_BYTES_PER_SECOND
+    return int(duration_s * (video_info.get("fps") or DEFAULT_FPS))
+
+
+def volume_size_for(video_size, write_video, stream_input=False, input_size=None):
+    """EBS volume in GB: room for the input video unless it is streamed, the rendered output video if requested, and overhead.
+
+    ``input_size`` is the size of the object the job downloads when it is
+    larger than the video it renders, e.g. a segment job of a long video.
+    """
+    input_gb = 0 if stream_input else (input_size or video_size) / (1024 ** 3)
+    output_gb = video_size / (1024 ** 3) if write_video else 0
+    needed = input_gb + output_gb + VOLUME_OVERHEAD_GB
+    return min(MAX_VOLUME_GB, max(MIN_VOLUME_GB, math.ceil(needed)))
+
+
+def max_runtime_for(predicted_hours):
+    seconds = int(predicted_hours * 3600 * RUNTIME_SAFETY_FACTOR) + 3600
+    return min(MAX_RUNTIME_SECONDS, max(MIN_RUNTIME_SECONDS, seconds))
+
+
+def plan_job(video_info, every, write_video=True, deadline_hours=DEADLINE_HOURS, stream_input=False):
+    """Return candidate job plans for a video, best first.
+
+    Each plan is a dict with ``machine``, ``frames`` (frames to process after
+    the ``every`` stride), ``predicted_hours``, ``predicted_cost``,
+    ``volume_size_gb`` and ``max_runtime_seconds``. The cheapest instance
+    type predicted to finish within ``deadline_hours`` comes first; types that
+    would overrun follow, fastest first, as fallbacks. With ``stream_input``
+    the volume isn't sized for the input video.
+    """
+    history = load_throughput_history()
+    frames = math.ceil(estimate_frames(video_info) / max(int(every), 1))
+    volume_size_gb = volume_size_for(video_info["size"], write_video, stream_input, video_info.get("input_size"))
+
+    plans = []
+    for machine, price in INSTANCE_PRICES.items():
+        frames_per_hour = history.get(machine, DEFAULT_FRAMES_PER_HOUR[machine])
+        predicted_hours = frames / frames_per_hour
+        plans.append({
+            "machine": machine,
+            "frames": frames,
+            "predicted_hours": predicted_hours,
+            "predicted_cost": predicted_hours * price,
+            "volume_size_gb": volume_size_gb,
+            "max_runtime_seconds": max_runtime_for(predicted_hours),
+        })
+
+    on_time = sorted((p for p in plans if p["predicted_hours"] <= deadline_hours), key=lambda p: (p["predicted_cost"], p["predicted_hours"]))
+    late = sorted((p for p in plans if p["predicted_hours"] > deadline_hours), key=lambda p: p["predicted_hours"])
+    return on_time + late
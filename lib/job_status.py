@@ -0,0 +1,55 @@
+import pandas as pd
+
+from .db import DEFAULT_PAGE_SIZE, fetch_processing_page, fetch_processing_rows, max_processing_id
+from .presign import presign_s3_uris
+
+STATUS_COLUMNS = ['File Name', 'Start Time', 'End Time', 'Duration (hrs)', 'Status', 'Download Link']
+# Columns read for a status page; the last two are needed to build download links
+PAGE_COLUMNS = ['File Name', 'Start Time', 'End Time', 'Duration (hrs)', 'Status', 'Write Video', 'Output Path']
+# Jobs in these states don't change any more, so polls don't re-read them
+TERMINAL_STATUSES = ('Completed', 'Failed', 'Stopped')
+
+
+def output_video_uri(row):
+    return f"{row['Output Path']}/{row['File Name'].replace('.mp4', '').replace('.h264', '')}_post_process_tracks.mp4"
+
+
+def _frame(rows):
+    if not rows:
+        return pd.DataFrame(columns=STATUS_COLUMNS)
+    for row in rows:
+        row['Download Link'] = None
+    # Links come from the shared presign cache, so unchanged rows aren't re-signed
+    completed = [row for row in rows if row['Write Video'] and row['Status'] == 'Completed']
+    for row, url in zip(completed, presign_s3_uris([output_video_uri(row) for row in completed])):
+        row['Download Link'] = url
+    return pd.DataFrame(rows)[STATUS_COLUMNS]
+
+
+def _row_changed(row, latest):
+    return latest is None or any(row[column] != value for column, value in latest.items())
+
+
+def poll_job_page(client, page=None, page_size=DEFAULT_PAGE_SIZE, after=None, **filters):
+    """Return ``(DataFrame, page, changed)`` for one page of ``client``'s jobs, newest first.
+
+    Filtering and paging happen in the database (see ``fetch_processing_page``
+    for ``filters``), so only the visible rows are read and have their
+    download links signed. ``page`` is the value returned by the previous
+    poll of the same page (None on the first). A poll then reads the highest
+    job ID, to spot new jobs, and the page's rows that aren't in a terminal
+    state. The page is only read again if a job was added or one of those
+    rows changed, which also keeps filters and order right; ``changed`` says
+    whether that happened.
+    """
+    if page is not None:
+        active = {row['ID']: row for row in page['rows'] if row['Status'] not in TERMINAL_STATUSES}
+        latest = fetch_processing_rows(list(active), PAGE_COLUMNS)
+        if max_processing_id() == page['max_id'] and not any(
+                _row_changed(row, latest.get(job_id)) for job_id, row in active.items()):
+            return _frame(page['rows']), page, False
+
+    max_id = max_processing_id()
+    rows, next_cursor = fetch_processing_page(client, PAGE_COLUMNS, limit=page_size, after=after, **filters)
+    page = {'rows': rows, 'next_cursor': next_cursor, 'max_id': max_id}
+    return _frame(rows), page, True
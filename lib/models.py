@@ -0,0 +1,72 @@
+import logging
+import threading
+import time
+
+import streamlit
+
+logger = logging.getLogger(streamlit.__name__)
+
+_models = {}
+_load_locks = {}
+_inference_locks = {}
+_registry_lock = threading.Lock()
+
+
+def get_model(key, loader, warmup=None, memory=None):
+    """Return the process-wide model for ``key``, loading it on first use.
+
+    ``loader()`` builds the model and ``warmup(model)``, if given, runs one
+    throwaway inference so the first real request doesn't pay for graph
+    building or kernel selection. ``memory(model)``, if given, returns the
+    model's footprint in bytes for ``model_stats``. Concurrent first calls for
+    the same key wait for a single load.
+    """
+    with _registry_lock:
+        entry = _models.get(key)
+        if entry is not None:
+            return entry["model"]
+        lock = _load_locks.setdefault(key, threading.Lock())
+
+    with lock:
+        with _registry_lock:
+            entry = _models.get(key)
+        if entry is not None:
+            return entry["model"]
+
+        start = time.perf_counter()
+        model = loader()
+        load_seconds = time.perf_counter() - start
+        warmup_seconds = 0.0
+        if warmup is not None:
+            start = time.perf_counter()
+            warmup(model)
+            warmup_seconds = time.perf_counter() - start
+        memory_bytes = memory(model) if memory is not None else None
+        logger.info(f"Loaded model {key} in {load_seconds:.2f}s (warm-up {warmup_seconds:.2f}s)")
+
+        with _registry_lock:
+            _models[key] = {"model": model, "load_seconds": load_seconds, "warmup_seconds": warmup_seconds,
+                            "memory_bytes": memory_bytes}
+        return model
+
+
+def get_model_lock(key):
+    """Return the lock serialising inference on the shared model for ``key``.
+
+    For models that keep per-call state on the instance (e.g. an ultralytics
+    predictor), so concurrent sessions calling the same model don't race.
+    """
+    with _registry_lock:
+        return _inference_locks.setdefault(key, threading.Lock())
+
+
+def model_stats():
+    """Return ``{key: {"load_seconds", "warmup_seconds", "memory_bytes"}}`` for every loaded model."""
+    with _registry_lock:
+        return {key: {k: v for k, v in entry.items() if k != "model"} for key, entry in _models.items()}
+
+
+def torch_memory_bytes(module):
+    """Bytes held by a torch module's parameters and buffers."""
+    tensors = list(module.parameters()) + list(module.buffers())
+    return sum(t.numel() * t.element_size() for t in tensors)
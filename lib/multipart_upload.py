@@ -0,0 +1,282 @@
+import base64
+import datetime
+import hashlib
+import json
+import logging
+import math
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+import streamlit
+from botocore.exceptions import ClientError
+
+from .aws import get_client
+
+logger = logging.getLogger(streamlit.__name__)
+
+# S3 multipart limits
+MIN_PART_SIZE = 5 * 1024 * 1024
+MAX_PARTS = 10000
+
+# Up to max_workers + 1 parts are in memory at once: 144 MiB with the defaults
+DEFAULT_PART_SIZE = 16 * 1024 * 1024
+DEFAULT_MAX_WORKERS = 8
+# Part size and file fingerprint of each unfinished upload are stored here,
+# since S3 doesn't return an upload's metadata until it is completed.
+UPLOAD_STATE_PREFIX = "multipart-uploads/"
+FINGERPRINT_BYTES = 1024 * 1024
+# Uploads with a part stored more recently than this may still be running
+RESUME_IDLE_SECONDS = 300
+
+
+def _b64(digest):
+    return base64.b64encode(digest).decode("ascii")
+
+
+def choose_part_size(total_size, part_size=DEFAULT_PART_SIZE):
+    """Return a part size that respects S3's minimum part size and 10,000 part limit."""
+    part_size = max(int(part_size), MIN_PART_SIZE)
+    return max(part_size, math.ceil(total_size / MAX_PARTS))
+
+
+def file_fingerprint(fileobj, total_size):
+    """Cheap identity for a local file: SHA-256 of its size and first and last MiB."""
+    digest = hashlib.sha256(str(total_size).encode("ascii"))
+    fileobj.seek(0)
+    digest.update(fileobj.read(FINGERPRINT_BYTES))
+    fileobj.seek(max(0, total_size - FINGERPRINT_BYTES))
+    digest.update(fileobj.read(FINGERPRINT_BYTES))
+    return digest.hexdigest()
+
+
+def _state_key(key, upload_id):
+    return f"{UPLOAD_STATE_PREFIX}{key}/{upload_id}.json"
+
+
+def _read_state(bucket, key, upload_id):
+    try:
+        response = get_client("s3").get_object(Bucket=bucket, Key=_state_key(key, upload_id))
+    except ClientError as e:
+        if e.response["Error"]["Code"] in ("NoSuchKey", "404"):
+            return None
+        raise
+    return json.loads(response["Body"].read())
+
+
+def _delete_state(bucket, key, upload_id):
+    try:
+        get_client("s3").delete_object(Bucket=bucket, Key=_state_key(key, upload_id))
+    except ClientError as e:
+        logger.warning(f"Could not delete upload state for {key}: {e}")
+
+
+def _incomplete_uploads(bucket, key):
+    """Yield ``(upload, state, parts, idle_seconds)`` for every unfinished upload of ``key``, newest first."""
+    s3_client = get_client("s3")
+    paginator = s3_client.get_paginator("list_multipart_uploads")
+    uploads = []
+    for page in paginator.paginate(Bucket=bucket, Prefix=key):
+        uploads.extend(upload for upload in page.get("Uploads", []) if upload["Key"] == key)
+
+    now = datetime.datetime.now(datetime.timezone.utc)
+    for upload in sorted(uploads, key=lambda upload: upload["Initiated"], reverse=True):
+        parts = list_completed_parts(bucket, key, upload["UploadId"])
+        last_activity = max([part["LastModified"] for part in parts.values()] + [upload["Initiated"]])
+        yield upload, _read_state(bucket, key, upload["UploadId"]) or {}, parts, (now - last_activity).total_seconds()
+
+
+def find_incomplete_upload(bucket, key, fingerprint, total_size, owner=None):
+    """Return ``(upload_id, part_size)`` of an unfinished upload of this same file, or ``(None, None)``.
+
+    Only uploads whose recorded state matches ``fingerprint`` and
+    ``total_size`` are considered, so another user's file with the same name
+    is never resumed. Uploads started by ``owner`` (e.g. the same Streamlit
+    session retrying after a failure) are always resumable; other uploads
+    that stored a part in the last ``RESUME_IDLE_SECONDS`` may still be
+    running and are left alone.
+    """
+    for upload, state, _, idle_seconds in _incomplete_uploads(bucket, key):
+        if state.get("fingerprint") != fingerprint or state.get("total_size") != total_size:
+            continue
+        if (owner is None or state.get("owner") != owner) and idle_seconds < RESUME_IDLE_SECONDS:
+            logger.info(f"Not resuming {upload['UploadId']} for {key}: it may still be uploading")
+            continue
+        return upload["UploadId"], state["part_size"]
+    return None, None
+
+
+def abort_upload(bucket, key, upload_id):
+    """Abort an unfinished multipart upload, freeing its stored parts, and delete its state."""
+    try:
+        get_client("s3").abort_multipart_upload(Bucket=bucket, Key=key, UploadId=upload_id)
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "NoSuchUpload":
+            logger.warning(f"Could not abort multipart upload {upload_id} for {key}: {e}")
+            return
+    _delete_state(bucket, key, upload_id)
+    logger.info(f"Aborted multipart upload {upload_id} for {key}")
+
+
+def abort_superseded_uploads(bucket, key, upload_id, owner=None):
+    """Abort the unfinished uploads of ``key`` that the completed ``upload_id`` supersedes.
+
+    Those are ``owner``'s own earlier attempts and any upload idle for
+    ``RESUME_IDLE_SECONDS``; uploads that may still be running are left alone.
+    """
+    for upload, state, _, idle_seconds in _incomplete_uploads(bucket, key):
+        if upload["UploadId"] == upload_id:
+            continue
+        if (owner is not None and state.get("owner") == owner) or idle_seconds >= RESUME_IDLE_SECONDS:
+            abort_upload(bucket, key, upload["UploadId"])
+
+
+def list_completed_parts(bucket, key, upload_id):
+    """Return ``{part_number: part}`` for the parts already stored for ``upload_id``."""
+    s3_client = get_client("s3")
+    paginator = s3_client.get_paginator("list_parts")
+    parts = {}
+    for page in paginator.paginate(Bucket=bucket, Key=key, UploadId=upload_id):
+        for part in page.get("Parts", []):
+            parts[part["PartNumber"]] = part
+    return parts
+
+
+def _resumable_parts(parts, fileobj, total_size, part_size):
+    """Return the stored parts that hold exactly the local bytes for their position.
+
+    The layout comes from the part size recorded when the upload was created,
+    and each part's stored ``ChecksumSHA256`` is compared with the SHA-256 of
+    the local bytes it stands for. Parts that don't match are left out and
+    uploaded again.
+    """
+    num_parts = max(1, math.ceil(total_size / part_size))
+    verified = {}
+    for number, part in parts.items():
+        if number > num_parts or "ChecksumSHA256" not in part:
+            continue
+        if part["Size"] != min(part_size, total_size - (number - 1) * part_size):
+            continue
+        fileobj.seek((number - 1) * part_size)
+        if _b64(hashlib.sha256(fileobj.read(part_size)).digest()) == part["ChecksumSHA256"]:
+            verified[number] = part
+    return verified
+
+
+def upload_fileobj_multipart(fileobj, bucket, key, total_size, part_size=DEFAULT_PART_SIZE,
+                             max_workers=DEFAULT_MAX_WORKERS, progress_callback=None, resume=True, owner=None):
+    """Upload a seekable file object to S3 with parallel multipart uploads.
+
+    Parts are read sequentially from ``fileobj`` and uploaded by a thread pool,
+    with at most ``max_workers + 1`` parts held in memory. Each part's SHA-256
+    is computed from the bytes as they are read and sent with the part so S3
+    verifies it; the composite object checksum is derived from the part
+    digests, so the file is never read twice.
+
+    If ``resume`` is set and an unfinished multipart upload of the same file
+    exists for ``key`` (see ``find_incomplete_upload``; ``owner`` identifies
+    the caller's own earlier attempts), stored parts whose checksum matches
+    the local bytes are skipped and only the rest are sent. On failure the
+    multipart upload is left in place so the next attempt can resume it, or
+    aborted if ``resume`` is off. Once the upload completes, the uploads it
+    supersedes are aborted (see ``abort_superseded_uploads``).
+
+    ``progress_callback(bytes_done, total_size)`` is called from the calling
+    thread, so it can safely update Streamlit elements.
+
+    :return: dict with ``key``, ``upload_id``, ``parts``, ``resumed_parts``,
+        ``etag`` and ``checksum_sha256``.
+    """
+    s3_client = get_client("s3")
+    part_size = choose_part_size(total_size, part_size)
+
+    completed = {}
+    upload_id = None
+    fingerprint = file_fingerprint(fileobj, total_size)
+    if resume:
+        upload_id, resumed_part_size = find_incomplete_upload(bucket, key, fingerprint, total_size, owner)
+    if upload_id is not None:
+        part_size = resumed_part_size
+        completed = _resumable_parts(list_completed_parts(bucket, key, upload_id), fileobj, total_size, part_size)
+        logger.info(f"Resuming multipart upload {upload_id} for {key} with {len(completed)} verified parts already stored")
+
+    if upload_id is None:
+        response = s3_client.create_multipart_upload(
+            Bucket=bucket, Key=key, ChecksumAlgorithm="SHA256",
+            Metadata={"part-size": str(part_size), "fingerprint": fingerprint},
+        )
+        upload_id = response["UploadId"]
+        s3_client.put_object(
+            Bucket=bucket, Key=_state_key(key, upload_id), ContentType="application/json",
+            Body=json.dumps({"part_size": part_size, "total_size": total_size, "fingerprint": fingerprint, "owner": owner}),
+        )
+
+    num_parts = max(1, math.ceil(total_size / part_size))
+    etags = {number: part["ETag"] for number, part in completed.items()}
+    digests = {number: base64.b64decode(part["ChecksumSHA256"]) for number, part in completed.items()}
+    bytes_done = sum(part["Size"] for part in completed.values())
+
+    def report():
+        if progress_callback is not None:
+            progress_callback(bytes_done, total_size)
+
+    def upload_part(number, data):
+        digest = hashlib.sha256(data).digest()
+        response = s3_client.upload_part(
+            Bucket=bucket, Key=key, UploadId=upload_id, PartNumber=number, Body=data,
+            ChecksumAlgorithm="SHA256", ChecksumSHA256=_b64(digest),
+        )
+        return number, response["ETag"], digest, len(data)
+
+    def collect(done):
+        nonlocal bytes_done
+        for future in done:
+            number, etag, digest, size = future.result()
+            etags[number] = etag
+            digests[number] = digest
+            bytes_done += size
+        report()
+
+    report()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            pending = set()
+            for number in range(1, num_parts + 1):
+                if number in completed:
+                    continue
+                fileobj.seek((number - 1) * part_size)
+                data = fileobj.read(part_size)
+                pending.add(pool.submit(upload_part, number, data))
+                # One part is read ahead while every worker is busy
+                if len(pending) > max_workers:
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(done)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                collect(done)
+
+        parts = [
+            {"PartNumber": number, "ETag": etags[number], "ChecksumSHA256": _b64(digests[number])}
+            for number in range(1, num_parts + 1)
+        ]
+        response = s3_client.complete_multipart_upload(
+            Bucket=bucket, Key=key, UploadId=upload_id, MultipartUpload={"Parts": parts}
+        )
+    except Exception:
+        if not resume:
+            abort_upload(bucket, key, upload_id)
+        raise
+
+    _delete_state(bucket, key, upload_id)
+    abort_superseded_uploads(bucket, key, upload_id, owner)
+
+    checksum = f"{_b64(hashlib.sha256(b''.join(digests[n] for n in range(1, num_parts + 1))).digest())}-{num_parts}"
+    if response.get("ChecksumSHA256") and response["ChecksumSHA256"] != checksum:
+        raise ValueError(f"Checksum mismatch for s3://{bucket}/{key}: expected {checksum}, got {response['ChecksumSHA256']}")
+
+    return {
+        "key": key,
+        "upload_id": upload_id,
+        "parts": num_parts,
+        "resumed_parts": len(completed),
+        "etag": response.get("ETag"),
+        "checksum_sha256": checksum,
+    }
@@ -0,0 +1,165 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+import requests
+import streamlit
+
+logger = logging.getLogger(streamlit.__name__)
+
+MAX_QUEUE_SIZE = 100
+# Notifications arriving within this window of the first one are sent together
+COALESCE_SECONDS = 2.0
+MAX_ATTEMPTS = 5
+BACKOFF_SECONDS = 1.0
+REQUEST_TIMEOUT_SECONDS = 10
+# Discord rejects embeds with longer field values or descriptions
+MAX_FIELD_LENGTH = 1024
+MAX_EMBEDS = 10
+
+
+def _truncate(value, limit=MAX_FIELD_LENGTH):
+    return value if len(value) <= limit else value[:limit - 1] + "…"
+
+
+def build_embed(title, description, color, fields):
+    return {
+        "title": title,
+        "description": description,
+        "color": color,
+        "fields": [dict(field, value=_truncate(field["value"])) for field in fields],
+        "footer": {
+            "text": "Streamlit App Notification"
+        }
+    }
+
+
+def coalesce(notifications):
+    """Merge notifications with the same title into one digest embed each, in arrival order."""
+    groups = {}
+    for notification in notifications:
+        groups.setdefault(notification["title"], []).append(notification)
+
+    embeds = []
+    for title, group in groups.items():
+        if len(group) == 1:
+            embeds.append(build_embed(**group[0]))
+            continue
+        file_names = [field["value"] for n in group for field in n["fields"] if field["name"] == "File Name"]
+        embeds.append(build_embed(
+            title=f"{title} ({len(group)})",
+            description=f"{len(group)} notifications: {group[0]['description']}",
+            color=group[0]["color"],
+            fields=[{"name": "File Names", "value": "\n".join(file_names), "inline": False}],
+        ))
+    return embeds
+
+
+class NotificationDispatcher:
+    """Posts webhook notifications from a background thread.
+
+    ``notify`` never blocks: notifications go on a bounded queue and are
+    dropped, with a warning, when it is full. The worker gathers everything that
+    arrives within ``COALESCE_SECONDS`` into one message, so a burst such as a
+    batch submission becomes a single digest. Posts reuse one HTTP session and
+    are retried with backoff on rate limiting (honouring ``retry_after``),
+    server errors and connection failures.
+    """
+
+    def __init__(self, webhook_url, max_queue_size=MAX_QUEUE_SIZE, coalesce_seconds=COALESCE_SECONDS):
+        self.webhook_url = webhook_url
+        self.coalesce_seconds = coalesce_seconds
+        self.queue = queue.Queue(maxsize=max_queue_size)
+        self.session = requests.Session()
+        self.session.headers.update({'Content-Type': 'application/json'})
+        self.stats = {"queued": 0, "dropped": 0, "sent": 0, "messages": 0, "retries": 0, "failed": 0}
+        self._worker = threading.Thread(target=self._run, name="notification-dispatcher", daemon=True)
+        self._worker.start()
+
+    def notify(self, title, description, color, fields):
+        """Queue a notification; returns False if it was dropped."""
+        try:
+            self.queue.put_nowait({"title": title, "description": description, "color": color, "fields": fields})
+        except queue.Full:
+            self.stats["dropped"] += 1
+            logger.warning(f"Notification queue full, dropping '{title}'")
+            return False
+        self.stats["queued"] += 1
+        return True
+
+    def flush(self, timeout=None):
+        """Wait until every queued notification has been sent or given up on."""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self.queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() > deadline:
+                return False
+            time.sleep(0.05)
+        return True
+
+    def _next_batch(self):
+        batch = [self.queue.get()]
+        deadline = time.monotonic() + self.coalesce_seconds
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return batch
+            try:
+                batch.append(self.queue.get(timeout=remaining))
+            except queue.Empty:
+                return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            try:
+                embeds = coalesce(batch)
+                for start in range(0, len(embeds), MAX_EMBEDS):
+                    self._post({"embeds": embeds[start:start + MAX_EMBEDS], "username": "TraffMind AI"})
+                self.stats["sent"] += len(batch)
+            except Exception as e:
+                self.stats["failed"] += len(batch)
+                logger.error(f"Failed to send {len(batch)} notifications: {e}")
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def _post(self, data):
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            try:
+                response = self.session.post(self.webhook_url, data=json.dumps(data), timeout=REQUEST_TIMEOUT_SECONDS)
+            except requests.RequestException as e:
+                if attempt == MAX_ATTEMPTS:
+                    raise
+                delay = BACKOFF_SECONDS * 2 ** (attempt - 1)
+                logger.warning(f"Webhook request failed ({e}), retrying in {delay:.1f}s")
+            else:
+                if response.status_code in (200, 204):
+                    self.stats["messages"] += 1
+                    return
+                retryable = response.status_code == 429 or response.status_code >= 500
+                if not retryable or attempt == MAX_ATTEMPTS:
+                    raise Exception(f"Request to Discord returned an error {response.status_code}, the response is:\n{response.text}")
+                delay = BACKOFF_SECONDS * 2 ** (attempt - 1)
+                if response.status_code == 429:
+                    try:
+                        delay = float(response.json().get("retry_after", delay))
+                    except ValueError:
+                        delay = float(response.headers.get("Retry-After", delay))
+            self.stats["retries"] += 1
+            time.sleep(delay)
+
+
+_dispatcher = None
+_dispatcher_lock = threading.Lock()
+
+
+def get_dispatcher():
+    """Return the process-wide dispatcher for the ``WEBHOOK_URL`` webhook, or None if unset."""
+    global _dispatcher
+    with _dispatcher_lock:
+        if _dispatcher is None and os.getenv("WEBHOOK_URL"):
+            _dispatcher = NotificationDispatcher(os.getenv("WEBHOOK_URL"))
+        return _dispatcher
@@ -0,0 +1,101 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import streamlit
+from botocore.exceptions import ClientError
+
+from .aws import get_client
+
+logger = logging.getLogger(streamlit.__name__)
+
+PRESIGN_EXPIRATION = 3600
+# A cached URL is only handed out while at least this fraction of its lifetime
+# remains, so a link shown on a page stays valid for a good while after.
+MIN_REMAINING_FRACTION = 0.5
+MAX_ENTRIES = 10000
+
+_entries = OrderedDict()
+_lock = threading.Lock()
+_stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+
+def split_s3_uri(s3_uri):
+    bucket_name, object_key = s3_uri.replace("s3://", "").split("/", 1)
+    return bucket_name, object_key
+
+
+def _lookup(cache_key, now):
+    entry = _entries.get(cache_key)
+    if entry is None:
+        return None
+    url, signed_at, expiration = entry
+    if now - signed_at > expiration * (1 - MIN_REMAINING_FRACTION):
+        del _entries[cache_key]
+        _stats["evictions"] += 1
+        return None
+    _entries.move_to_end(cache_key)
+    return url
+
+
+def presign_many(objects, expiration=PRESIGN_EXPIRATION):
+    """Presign ``(bucket, key)`` pairs for ``get_object``, reusing cached URLs.
+
+    Returns URLs in input order, with None where signing failed. Cache misses
+    are signed together with one pooled client outside the cache lock.
+    """
+    now = time.time()
+    urls = [None] * len(objects)
+    missing = []
+    with _lock:
+        for i, (bucket_name, object_key) in enumerate(objects):
+            url = _lookup((bucket_name, object_key, expiration), now)
+            if url is None:
+                missing.append(i)
+                _stats["misses"] += 1
+            else:
+                urls[i] = url
+                _stats["hits"] += 1
+
+    if not missing:
+        return urls
+
+    s3_client = get_client('s3')
+    signed = {}
+    for i in missing:
+        bucket_name, object_key = objects[i]
+        try:
+            urls[i] = s3_client.generate_presigned_url('get_object',
+                                                       Params={'Bucket': bucket_name, 'Key': object_key},
+                                                       ExpiresIn=expiration)
+            signed[(bucket_name, object_key, expiration)] = (urls[i], now, expiration)
+        except ClientError as e:
+            logger.error(e)
+
+    with _lock:
+        _entries.update(signed)
+        while len(_entries) > MAX_ENTRIES:
+            _entries.popitem(last=False)
+            _stats["evictions"] += 1
+    return urls
+
+
+def presign(bucket_name, object_key, expiration=PRESIGN_EXPIRATION):
+    """Presign one object; see ``presign_many``."""
+    return presign_many([(bucket_name, object_key)], expiration)[0]
+
+
+def presign_s3_uris(s3_uris, expiration=PRESIGN_EXPIRATION):
+    """Presign a batch of ``s3://bucket/key`` URIs; see ``presign_many``."""
+    return presign_many([split_s3_uri(uri) for uri in s3_uris], expiration)
+
+
+def presign_stats():
+    """Return cache counters plus ``hit_rate`` and current ``size``."""
+    with _lock:
+        stats = dict(_stats)
+        stats["size"] = len(_entries)
+    lookups = stats["hits"] + stats["misses"]
+    stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+    return stats
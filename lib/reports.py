@@ -0,0 +1,346 @@
+import ast
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import streamlit
+from botocore.exceptions import ClientError
+
+from .aws import get_client, get_listing_index
+
+logger = logging.getLogger(streamlit.__name__)
+
+INTERVAL_MINUTES = 15
+CLASS_SCHEMES = {
+    "6 bins": list(range(1, 7)),
+    "13 bins (FHWA)": list(range(1, 14)),
+}
+DEFAULT_CLASSES = CLASS_SCHEMES["6 bins"]
+COLUMNAR_REPORT_VERSION = 1
+COLUMNAR_SUFFIX = ".counts.json"
+COUNT_COLUMNS = ["interval", "movement", "class", "count"]
+
+
+def columnar_key_for(report_key):
+    """Key of the columnar companion written next to a legacy ``.txt`` report."""
+    return report_key[:-len(".txt")] + COLUMNAR_SUFFIX if report_key.endswith(".txt") else report_key + COLUMNAR_SUFFIX
+
+
+def parse_legacy_report(text):
+    """Parse a legacy report: the first line is a Python literal list with one
+    ``{movement: {class: count}}`` dict per interval. Uses ``ast.literal_eval``,
+    never ``eval``."""
+    movement_dict_list = ast.literal_eval(text.splitlines()[0])
+    if not isinstance(movement_dict_list, list):
+        raise ValueError("Legacy report must be a list of per-interval dicts")
+    return movement_dict_list
+
+
+def legacy_to_counts(movement_dict_list):
+    """Flatten per-interval dicts into a long counts frame (interval, movement, class, count).
+
+    Empty intervals produce no rows but keep their position on the timeline.
+    """
+    records = [
+        (interval, str(movement), int(class_number), int(count))
+        for interval, movement_dict in enumerate(movement_dict_list) if movement_dict
+        for movement, counts_dict in movement_dict.items()
+        for class_number, count in counts_dict.items()
+    ]
+    counts = pd.DataFrame.from_records(records, columns=COUNT_COLUMNS)
+    return counts.astype({"interval": np.int32, "class": np.int16, "count": np.int64})
+
+
+def counts_to_columnar(counts, interval_minutes=INTERVAL_MINUTES, source_etag=None):
+    """Serialise a counts frame to the columnar JSON report format.
+
+    ``source_etag`` is the ETag of the legacy report the counts were parsed
+    from, so readers can tell when the companion no longer matches it.
+    """
+    return json.dumps({
+        "version": COLUMNAR_REPORT_VERSION,
+        "interval_minutes": interval_minutes,
+        "source_etag": source_etag,
+        "columns": {column: counts[column].tolist() for column in COUNT_COLUMNS},
+    })
+
+
+def _read_columnar(text):
+    report = json.loads(text)
+    if report.get("version") != COLUMNAR_REPORT_VERSION:
+        raise ValueError(f"Unsupported report version {report.get('version')}")
+    counts = pd.DataFrame(report["columns"], columns=COUNT_COLUMNS)
+    counts = counts.astype({"interval": np.int32, "movement": str, "class": np.int16, "count": np.int64})
+    return counts, report.get("interval_minutes", INTERVAL_MINUTES), report.get("source_etag")
+
+
+def columnar_to_counts(text):
+    """Parse a columnar JSON report into ``(counts, interval_minutes)``."""
+    counts, interval_minutes, _ = _read_columnar(text)
+    return counts, interval_minutes
+
+
+def parse_report(text):
+    """Parse either report format into ``(counts, interval_minutes)``."""
+    if text.lstrip().startswith("{"):
+        return columnar_to_counts(text)
+    return legacy_to_counts(parse_legacy_report(text)), INTERVAL_MINUTES
+
+
+def write_columnar_report(bucket, report_key, counts, interval_minutes=INTERVAL_MINUTES, source_etag=None):
+    """Write the columnar companion of ``report_key`` to S3.
+
+    ``source_etag`` should be the ETag of the ``report_key`` object the counts
+    came from; the companion is only trusted while the two match.
+    """
+    get_client('s3').put_object(
+        Bucket=bucket, Key=columnar_key_for(report_key),
+        Body=counts_to_columnar(counts, interval_minutes, source_etag), ContentType="application/json",
+    )
+
+
+def _is_missing(error):
+    return error.response["Error"]["Code"] in ("NoSuchKey", "404", "NotFound")
+
+
+def _is_not_modified(error):
+    return error.response["Error"]["Code"] in ("304", "NotModified")
+
+
+def _source_etag(bucket, report_key):
+    try:
+        return get_client('s3').head_object(Bucket=bucket, Key=report_key)["ETag"]
+    except ClientError as e:
+        if not _is_missing(e):
+            raise
+        return None
+
+
+def _get_report(bucket, report_key):
+    """GET a report into memory, preferring the columnar companion.
+
+    Returns ``(source_key, etag, counts, interval_minutes)``. The companion is
+    used only while the ETag recorded in it matches the legacy report's, so a
+    rewritten or re-run report is never shadowed by stale counts. Otherwise
+    the legacy text report is parsed and the companion rewritten so later
+    reads skip the legacy parse. A companion without a legacy report is used
+    as-is.
+    """
+    s3_client = get_client('s3')
+    companion_key = columnar_key_for(report_key)
+    source_etag = _source_etag(bucket, report_key)
+    try:
+        response = s3_client.get_object(Bucket=bucket, Key=companion_key)
+        counts, interval_minutes, companion_source_etag = _read_columnar(response["Body"].read().decode("utf-8"))
+        if source_etag is None:
+            return companion_key, response["ETag"], counts, interval_minutes
+        if companion_source_etag == source_etag:
+            return report_key, source_etag, counts, interval_minutes
+        logger.info(f"Columnar report for {report_key} is stale, re-parsing the legacy report")
+    except ClientError as e:
+        if not _is_missing(e):
+            raise
+
+    response = s3_client.get_object(Bucket=bucket, Key=report_key)
+    counts, interval_minutes = _parse_legacy_response(bucket, report_key, response)
+    return report_key, response["ETag"], counts, interval_minutes
+
+
+def _parse_legacy_response(bucket, report_key, response):
+    """Parse a GET response for a legacy report and rewrite its columnar companion."""
+    counts, interval_minutes = parse_report(response["Body"].read().decode("utf-8"))
+    try:
+        write_columnar_report(bucket, report_key, counts, interval_minutes, response["ETag"])
+    except ClientError as e:
+        logger.warning(f"Could not write columnar report for {report_key}: {e}")
+    return counts, interval_minutes
+
+
+# Parsed reports keyed by (bucket, report key), revalidated against S3 with
+# conditional GETs once they are older than REVALIDATE_AFTER_SECONDS.
+REPORT_CACHE_MAX_ITEMS = 256
+REVALIDATE_AFTER_SECONDS = 30
+PREFETCH_COUNT = 10
+PREFETCH_WORKERS = 4
+
+_report_cache = OrderedDict()
+_report_cache_lock = threading.Lock()
+_prefetch_pool = ThreadPoolExecutor(max_workers=PREFETCH_WORKERS, thread_name_prefix="report-prefetch")
+_prefetching = set()
+
+
+def load_report(bucket, report_key):
+    """Return ``(counts, interval_minutes)`` for a report, from memory when it is unchanged.
+
+    Nothing is written to local disk. A cached report is returned as-is for
+    ``REVALIDATE_AFTER_SECONDS``, then revalidated with ``If-None-Match`` on
+    its ETag, so an unchanged report costs one 304 response instead of a
+    download and parse, and a changed one is parsed from that same response.
+    """
+    cache_key = (bucket, report_key)
+    with _report_cache_lock:
+        entry = _report_cache.get(cache_key)
+        if entry is not None:
+            _report_cache.move_to_end(cache_key)
+
+    now = time.time()
+    if entry is not None:
+        source_key, etag, counts, interval_minutes, checked_at = entry
+        if now - checked_at < REVALIDATE_AFTER_SECONDS:
+            return counts, interval_minutes
+        try:
+            response = get_client('s3').get_object(Bucket=bucket, Key=source_key, IfNoneMatch=etag)
+        except ClientError as e:
+            if not _is_not_modified(e):
+                raise
+            with _report_cache_lock:
+                _report_cache[cache_key] = (source_key, etag, counts, interval_minutes, now)
+            return counts, interval_minutes
+        # Changed: the conditional GET already returned the new body
+        etag = response["ETag"]
+        if source_key == report_key:
+            counts, interval_minutes = _parse_legacy_response(bucket, report_key, response)
+        else:
+            counts, interval_minutes = columnar_to_counts(response["Body"].read().decode("utf-8"))
+    else:
+        source_key, etag, counts, interval_minutes = _get_report(bucket, report_key)
+
+    with _report_cache_lock:
+        _report_cache[cache_key] = (source_key, etag, counts, interval_minutes, now)
+        _report_cache.move_to_end(cache_key)
+        while len(_report_cache) > REPORT_CACHE_MAX_ITEMS:
+            _report_cache.popitem(last=False)
+    return counts, interval_minutes
+
+
+def _prefetch(bucket, report_key):
+    try:
+        load_report(bucket, report_key)
+    except Exception as e:
+        logger.warning(f"Prefetching {report_key} failed: {e}")
+    finally:
+        with _report_cache_lock:
+            _prefetching.discard((bucket, report_key))
+
+
+def prefetch_reports(bucket, report_keys):
+    """Load reports into the cache on a background thread pool.
+
+    Reports already cached or already being fetched are skipped.
+    """
+    with _report_cache_lock:
+        keys = [key for key in report_keys
+                if (bucket, key) not in _report_cache and (bucket, key) not in _prefetching]
+        _prefetching.update((bucket, key) for key in keys)
+    for key in keys:
+        _prefetch_pool.submit(_prefetch, bucket, key)
+    return keys
+
+
+def prefetch_recent_reports(bucket, report_keys, n=PREFETCH_COUNT, prefix="outputs/"):
+    """Prefetch the ``n`` most recently modified of ``report_keys``, dated from the shared listing index of ``prefix``."""
+    wanted = set(report_keys)
+    entries = [entry for entry in get_listing_index(bucket, prefix).entries() if entry["Key"] in wanted]
+    entries.sort(key=lambda entry: entry["LastModified"], reverse=True)
+    return prefetch_reports(bucket, [entry["Key"] for entry in entries[:n]])
+
+
+def build_display_table(counts, interval_minutes=INTERVAL_MINUTES, classes=None):
+    """Pivot a counts frame into the Step 4 table.
+
+    One row per (interval, class) for every interval with any counts, one
+    column per movement (in order of first appearance), and ``From``/``To``
+    filled on the first class row of each interval only.
+    """
+    classes = list(classes) if classes is not None else CLASS_SCHEMES[detect_class_scheme(counts)]
+    if counts.empty:
+        return pd.DataFrame(columns=["From", "To", "class"])
+
+    movements = pd.unique(counts["movement"])
+    intervals = np.sort(pd.unique(counts["interval"]))
+    table = counts.pivot_table(index=["interval", "class"], columns="movement", values="count", aggfunc="sum", fill_value=0)
+    full_index = pd.MultiIndex.from_product([intervals, classes], names=["interval", "class"])
+    table = table.reindex(index=full_index, columns=movements, fill_value=0).astype(np.int64)
+    table.columns.name = None
+    table = table.reset_index()
+
+    first_row = table["class"].to_numpy() == classes[0]
+    start = table["interval"].to_numpy() * interval_minutes
+    table.insert(0, "From", np.where(first_row, pd.Series(start).astype(str) + " min", ""))
+    table.insert(1, "To", np.where(first_row, pd.Series(start + interval_minutes).astype(str) + " min", ""))
+    return table.drop(columns="interval")
+
+
+def detect_class_scheme(counts):
+    """Name of the smallest class scheme in ``CLASS_SCHEMES`` that covers every class in ``counts``."""
+    highest = int(counts["class"].max()) if not counts.empty else 0
+    for name, classes in CLASS_SCHEMES.items():
+        if highest <= classes[-1]:
+            return name
+    return list(CLASS_SCHEMES)[-1]
+
+
+def rebin_counts(counts, interval_minutes, target_minutes):
+    """Sum counts into coarser intervals of ``target_minutes``.
+
+    ``target_minutes`` must be a whole multiple of ``interval_minutes``.
+    """
+    if target_minutes % interval_minutes:
+        raise ValueError(f"Can't re-bin {interval_minutes} minute counts into {target_minutes} minute intervals")
+    factor = target_minutes // interval_minutes
+    if factor == 1 or counts.empty:
+        return counts
+    rebinned = counts.assign(interval=counts["interval"].to_numpy() // factor)
+    return rebinned.groupby(["interval", "movement", "class"], as_index=False, sort=False)["count"].sum()[COUNT_COLUMNS]
+
+
+def peak_hour(counts, interval_minutes=INTERVAL_MINUTES, window_minutes=60):
+    """Find the busiest ``window_minutes`` window, sliding by one interval.
+
+    Returns a dict with ``start``/``end`` (minutes from the start of the
+    video), ``total`` and ``by_movement`` totals, or None if there are no counts.
+    """
+    if counts.empty:
+        return None
+    window = max(1, window_minutes // interval_minutes)
+    intervals = counts["interval"].to_numpy()
+    totals = np.bincount(intervals, weights=counts["count"].to_numpy(), minlength=intervals.max() + 1)
+    sums = np.convolve(totals, np.ones(window), mode="valid") if len(totals) >= window else np.array([totals.sum()])
+    start = int(np.argmax(sums))
+
+    in_window = (intervals >= start) & (intervals < start + window)
+    by_movement = counts[in_window].groupby("movement", sort=False)["count"].sum()
+    return {
+        "start": start * interval_minutes,
+        "end": (start + window) * interval_minutes,
+        "total": int(sums[start]),
+        "by_movement": {movement: int(total) for movement, total in by_movement.items()},
+    }
+
+
+def approach_of(movement):
+    """Approach a movement comes from, e.g. ``"N"`` for ``"N_S"``, ``"N->E"`` or ``"N to W"``."""
+    for separator in ("->", "_", "-", " to ", " "):
+        if separator in movement:
+            return movement.split(separator, 1)[0].strip()
+    return movement[:1]
+
+
+def approach_totals(counts, classes=None):
+    """Totals per approach (rows) and class (columns), plus a ``Total`` column."""
+    classes = list(classes) if classes is not None else CLASS_SCHEMES[detect_class_scheme(counts)]
+    if counts.empty:
+        return pd.DataFrame(columns=["approach"] + classes + ["Total"])
+    approach = counts["movement"].map({movement: approach_of(movement) for movement in pd.unique(counts["movement"])})
+    table = counts.assign(approach=approach).pivot_table(
+        index="approach", columns="class", values="count", aggfunc="sum", fill_value=0
+    )
+    table = table.reindex(columns=classes, fill_value=0).astype(np.int64)
+    table["Total"] = table.sum(axis=1)
+    table.columns.name = None
+    return table.reset_index()
@@ -1,4 +1,3 @@
-import boto3
 import sys
 import random
 import hashlib
@@ -7,16 +6,55 @@ import datetime
 import logging
 import os
 
+from concurrent.futures import ThreadPoolExecutor
+
 from botocore.exceptions import ClientError
 
 import streamlit
 
+from .aws import get_client, write_vectors_to_s3
+from .job_planner import plan_job
+
 logger = logging.getLogger(streamlit.__name__)
 
+SUPPORTED_VIDEO_TYPES = ("mp4", "h264")
+THROTTLING_ERROR_CODES = {"ThrottlingException", "Throttling", "TooManyRequestsException", "RequestLimitExceeded"}
+SUBMIT_MAX_ATTEMPTS = 6
+BATCH_MAX_WORKERS = 4
+EVERY = 3
+
+# Used when a job can't be planned (e.g. the video can't be probed)
+DEFAULT_MACHINE_TYPES = ["ml.g4dn.8xlarge", "ml.p3.2xlarge"]
+DEFAULT_VOLUME_SIZE_GB = 30
+DEFAULT_MAX_RUNTIME_SECONDS = 3600 * 18
 
-def start_sagemaker_processing_job(infile, machine, environment_variables, write_video):
-    access_key = os.getenv("AWS_ACCESS_KEY_ID")
-    secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
+# S3InputMode per processing input. The current container (1.2.45) reads the
+# video as a file, so it stays in File mode. Pipe mode (streaming through a
+# FIFO, so decoding overlaps the transfer) is opt-in for containers that read
+# from the pipe; it can't seek, so MP4s with a trailing moov need File mode.
+VIDEO_INPUT_MODE = os.getenv("VIDEO_INPUT_MODE", "File")
+# Only when the container decodes straight from the pipe, rather than copying
+# it to disk first, can the input video be left out of the EBS volume size.
+CONTAINER_STREAMS_VIDEO = VIDEO_INPUT_MODE == "Pipe" and os.getenv("CONTAINER_STREAMS_VIDEO", "false").lower() == "true"
+DEFAULT_INPUT_MODES = {
+    "input_path": VIDEO_INPUT_MODE,
+    "class_mapping": "File",
+    "classifier_model": "File",
+}
+
+
+def base_filename_for(infile):
+    filetype = infile.split('.')[-1]
+    return infile.split('/')[-1].replace(f'.{filetype}', '')
+
+
+def vectors_key_for(infile):
+    return f"submissions/{base_filename_for(infile)}/vectors.txt"
+
+
+def start_sagemaker_processing_job(infile, machine, environment_variables, write_video, job_suffix=None,
+                                   volume_size_gb=DEFAULT_VOLUME_SIZE_GB, max_runtime_seconds=DEFAULT_MAX_RUNTIME_SECONDS,
+                                   output_path=None, input_modes=None):
     datetime_str = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
 
     region = 'us-east-2'
@@ -24,7 +62,7 @@ def start_sagemaker_processing_job(infile, machine, environment_variables, write
     VERSION = "1.2.45"
 
     # Initialize the SageMaker client
-    sagemaker_client = boto3.client('sagemaker', region_name=region, aws_access_key_id=access_key, aws_secret_access_key=secret_key)
+    sagemaker_client = get_client('sagemaker', region)
 
     # Specify the S3 bucket and file paths
     client = "jamar"
@@ -37,9 +75,10 @@ def start_sagemaker_processing_job(infile, machine, environment_variables, write
     classifier_model_path = "s3://traffmind-classifiers/yolov8m-cls-best-20240617-120845/model.pt"
 
     filetype = infile.split('.')[-1]
-    base_filename = infile.split('/')[-1].replace(f'.{filetype}', '')
+    base_filename = base_filename_for(infile)
     input_path = f's3://{bucket}/client_upload/{infile}'
-    output_path = f's3://{bucket}/outputs/{base_filename}_{datetime_str}'
+    if output_path is None:
+        output_path = f's3://{bucket}/outputs/{base_filename}_{datetime_str}'
     tracks_output_path = f'{output_path}/tracks/'
 
     epoch_time = int(time.time())
@@ -47,6 +86,9 @@ def start_sagemaker_processing_job(infile, machine, environment_variables, write
 
     VECTORS_PREFIX = f"submissions/{base_filename}"
     processing_job_name = f"{client[:5]}-{version_number}-{epoch_time}"
+    if job_suffix is not None:
+        # Batch submissions start several jobs within the same second
+        processing_job_name = f"{processing_job_name}-{job_suffix}"
 
     # Add vectors prefix to environment variables
     environment_variables["VECTORS_PREFIX"] = VECTORS_PREFIX
@@ -58,6 +100,10 @@ def start_sagemaker_processing_job(infile, machine, environment_variables, write
     environment_variables["CLASS_MAPPING_PATH"] = class_mapping_path
     environment_variables["PROCESSING_JOB_NAME"] = processing_job_name
 
+    input_modes = {**DEFAULT_INPUT_MODES, **(input_modes or {})}
+    # Tells the container whether to read the video from a file or a pipe
+    environment_variables["VIDEO_INPUT_MODE"] = input_modes["input_path"]
+
     # Define the processing job configuration
     processing_outputs = [
         {
@@ -111,7 +157,7 @@ def start_sagemaker_processing_job(infile, machine, environment_variables, write
                 'S3Uri': input_path,
                 'LocalPath': '/opt/ml/processing/input',
                 'S3DataType': 'S3Prefix',
-                'S3InputMode': 'File',
+                'S3InputMode': input_modes['input_path'],
                 'S3DataDistributionType': 'FullyReplicated'
             }
         },
@@ -121,7 +167,7 @@ def start_sagemaker_processing_job(infile, machine, environment_variables, write
                 'S3Uri': class_mapping_path,
                 'LocalPath': '/opt/ml/processing/class_mapping',
                 'S3DataType': 'S3Prefix',
-                'S3InputMode': 'File',
+                'S3InputMode': input_modes['class_mapping'],
                 'S3DataDistributionType': 'FullyReplicated'
             }
         },
@@ -131,7 +177,7 @@ def start_sagemaker_processing_job(infile, machine, environment_variables, write
                 'S3Uri': classifier_model_path,
                 'LocalPath': '/opt/ml/processing/model',
                 'S3DataType': 'S3Prefix',
-                'S3InputMode': 'File',
+                'S3InputMode': input_modes['classifier_model'],
                 'S3DataDistributionType': 'FullyReplicated'
             }
         }
@@ -144,11 +190,11 @@ def start_sagemaker_processing_job(infile, machine, environment_variables, write
             'ClusterConfig': {
                 'InstanceCount': 1,
                 'InstanceType': machine,
-                'VolumeSizeInGB': 30
+                'VolumeSizeInGB': volume_size_gb
             }
         },
         'StoppingCondition': {
-            'MaxRuntimeInSeconds': 3600 * 18
+            'MaxRuntimeInSeconds': max_runtime_seconds
         }
     }
 
@@ -157,18 +203,162 @@ def start_sagemaker_processing_job(infile, machine, environment_variables, write
     print(f"Processing job started with ARN: {response['ProcessingJobArn']}")
     return response
 
-def run(infile, write_video=True):
+def _start_with_retry(infile, machine_type, environment_variables, write_video, job_suffix=None, **job_options):
+    """Start a processing job, backing off with jitter while SageMaker is throttling us."""
+    for attempt in range(SUBMIT_MAX_ATTEMPTS):
+        try:
+            return start_sagemaker_processing_job(infile, machine_type, dict(environment_variables), write_video, job_suffix, **job_options)
+        except ClientError as e:
+            code = e.response.get("Error", {}).get("Code")
+            if code not in THROTTLING_ERROR_CODES or attempt == SUBMIT_MAX_ATTEMPTS - 1:
+                raise
+            delay = min(30, 2 ** attempt) * (0.5 + random.random())
+            logger.info(f"Throttled submitting {infile} ({code}), retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+
+def plan_submission(infile, write_video=True, bucket="jamar", video_info=None):
+    """Return job plans for ``infile``, best first (see ``lib.job_planner.plan_job``).
+
+    Falls back to the default machine types and resources if the video can't
+    be probed.
+    """
+    from .video import probe_video
+
+    try:
+        if video_info is None:
+            video_info = probe_video(bucket, f"client_upload/{infile}")
+        return plan_job(video_info, EVERY, write_video, stream_input=CONTAINER_STREAMS_VIDEO)
+    except Exception as e:
+        logger.info(f"Could not plan job for {infile}, using defaults. error: {e}")
+        return [
+            {"machine": machine_type, "volume_size_gb": DEFAULT_VOLUME_SIZE_GB, "max_runtime_seconds": DEFAULT_MAX_RUNTIME_SECONDS}
+            for machine_type in DEFAULT_MACHINE_TYPES
+        ]
+
+
+def _environment_for(machine_type):
     classifier_yaml_path = "classifier/yolo_cls/yolov8m-cls-6.yaml"
-    machine_types = ["ml.p3.2xlarge", "ml.g4dn.8xlarge"]
-    while machine_types:
-        machine_type = machine_types.pop()
+    return {"AWS": "True", "VECTORS_BUCKET": "jamar", "EVERY": str(EVERY),"MACHINE":machine_type, "SHOW_VECTORS": "True", "CLASSIFIER_YAML_PATH": classifier_yaml_path, "IMAGE_CLASSIFIER_PATH": "/opt/ml/processing/model/model.pt", "WRITE_VIDEO": "True", "WRITE_TRACKS": "True", "VECTORS_PATTERN": "vector"}
+
+
+def submit_with_plans(infile, plans, write_video=True, job_suffix=None, output_path=None, extra_environment=None):
+    """Submit one job, trying the planned machine types in order.
+
+    Returns ``(plan, response)``; raises the last ``ClientError`` if no
+    machine type could be started.
+    """
+    last_error = None
+    for plan in plans:
+        machine_type = plan["machine"]
+        logger.info(f"Planned {infile} on {machine_type}: {plan}")
+        environment_variables = _environment_for(machine_type)
+        environment_variables.update(extra_environment or {})
         try:
-            start_sagemaker_processing_job(infile, machine_type, {"AWS": "True", "VECTORS_BUCKET": "jamar", "EVERY": "3","MACHINE":machine_type, "SHOW_VECTORS": "True", "CLASSIFIER_YAML_PATH": classifier_yaml_path, "IMAGE_CLASSIFIER_PATH": "/opt/ml/processing/model/model.pt", "WRITE_VIDEO": "True", "WRITE_TRACKS": "True", "VECTORS_PATTERN": "vector"}, write_video)
-            break
+            response = _start_with_retry(infile, machine_type, environment_variables, write_video, job_suffix,
+                                         volume_size_gb=plan["volume_size_gb"], max_runtime_seconds=plan["max_runtime_seconds"],
+                                         output_path=output_path)
+            return plan, response
         except ClientError as e:
             print(e)
             logger.info(f"Failed to start processing job. error: {e}")
+            last_error = e
+    raise last_error
+
+
+def _submit_job(infile, write_video=True, job_suffix=None):
+    return submit_with_plans(infile, plan_submission(infile, write_video), write_video, job_suffix)
+
+
+def run(infile, write_video=True, shard=False):
+    """Submit ``infile`` for processing.
+
+    With ``shard``, and sharding enabled for the deployment, videos longer
+    than ``lib.sharding.SHARD_THRESHOLD_SECONDS`` are split into time segments
+    processed by parallel jobs (see ``lib.sharding.run_sharded``).
+
+    Returns None if the job could not be started on any machine type.
+    """
+    try:
+        if shard:
+            from .sharding import run_sharded, should_shard
+            from .video import probe_video
+
+            video_info = probe_video("jamar", f"client_upload/{infile}")
+            if should_shard(video_info):
+                return run_sharded(infile, video_info, write_video)
+        return _submit_job(infile, write_video)
+    except ClientError as e:
+        logger.info(f"Failed to start processing job. error: {e}")
+        return None
+    except Exception as e:
+        logger.info(f"Failed to start processing job. error: {e}")
+        print(e)
+        raise
+
+
+def validate_batch(infiles, bucket="jamar", require_vectors=True):
+    """Check a batch of videos before anything is submitted.
+
+    Returns ``{infile: error message or None}``, with duplicates collapsed. A
+    video is valid if it has a supported extension, exists under
+    ``client_upload/`` and, if ``require_vectors``, has a vectors file under
+    ``submissions/``.
+    """
+    s3_client = get_client('s3')
+    errors = {}
+    for infile in dict.fromkeys(infiles):
+        error = None
+        if infile.split('.')[-1].lower() not in SUPPORTED_VIDEO_TYPES:
+            error = f"Unsupported file type (expected one of {', '.join(SUPPORTED_VIDEO_TYPES)})"
+        else:
+            checks = [(f"client_upload/{infile}", "Video not found in client_upload/")]
+            if require_vectors:
+                checks.append((vectors_key_for(infile), "No vectors have been saved for this video"))
+            for key, missing in checks:
+                try:
+                    s3_client.head_object(Bucket=bucket, Key=key)
+                except ClientError as e:
+                    if e.response.get("Error", {}).get("Code") in ("404", "NoSuchKey", "NotFound"):
+                        error = missing
+                        break
+                    raise
+        errors[infile] = error
+    return errors
+
+
+def run_batch(infiles, write_video=True, max_workers=BATCH_MAX_WORKERS, vectors=None):
+    """Validate and submit many videos concurrently.
+
+    Every video is validated before any job is started. If ``vectors`` are
+    given they are saved for the valid videos only, replacing their own;
+    otherwise each video must already have saved vectors. Valid videos are
+    submitted on a thread pool of ``max_workers`` with throttling-aware retry.
+    Returns one summary dict per input video, in input order, with keys
+    ``File Name``, ``Status`` (``Submitted``, ``Invalid`` or ``Failed``),
+    ``Machine``, ``Predicted Hours``, ``Processing Job Name`` and ``Error``.
+    """
+    errors = validate_batch(infiles, require_vectors=vectors is None)
+    results = {
+        infile: {"File Name": infile, "Status": "Invalid", "Machine": None, "Predicted Hours": None, "Processing Job Name": None, "Error": error}
+        for infile, error in errors.items() if error
+    }
+
+    def submit(index, infile):
+        try:
+            plan, response = _submit_job(infile, write_video, job_suffix=index)
+            job_name = response['ProcessingJobArn'].split('/')[-1]
+            return {"File Name": infile, "Status": "Submitted", "Machine": plan["machine"], "Predicted Hours": plan.get("predicted_hours"), "Processing Job Name": job_name, "Error": None}
         except Exception as e:
-            logger.info(f"Failed to start processing job. error: {e}")
-            print(e)
-            raise
\ No newline at end of file
+            logger.info(f"Failed to submit {infile}. error: {e}")
+            return {"File Name": infile, "Status": "Failed", "Machine": None, "Predicted Hours": None, "Processing Job Name": None, "Error": str(e)}
+
+    valid = [infile for infile in dict.fromkeys(infiles) if not errors[infile]]
+    if vectors is not None:
+        for infile in valid:
+            write_vectors_to_s3(vectors, "jamar", vectors_key_for(infile))
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for result in pool.map(submit, range(len(valid)), valid):
+            results[result["File Name"]] = result
+
+    return [results[infile] for infile in dict.fromkeys(infiles)]
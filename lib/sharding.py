@@ -0,0 +1,227 @@
+import datetime
+import json
+import logging
+import math
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import streamlit
+from botocore.exceptions import ClientError
+
+from .aws import get_client, iter_files, region
+from .reports import legacy_to_counts, parse_legacy_report, write_columnar_report
+from .sagemaker_processing import CONTAINER_STREAMS_VIDEO, EVERY, base_filename_for, plan_submission, submit_with_plans
+
+logger = logging.getLogger(streamlit.__name__)
+
+# Segment jobs need a processing container that honours SEGMENT_START_SECONDS
+# and SEGMENT_END_SECONDS; older containers process the whole video in every
+# segment job. Sharding stays off unless the deployment opts in.
+SHARDING_ENABLED = os.getenv("SEGMENTED_PROCESSING", "false").lower() == "true"
+
+# Count reports hold one dict per 15 minute interval
+INTERVAL_SECONDS = 15 * 60
+# Videos longer than this are split; segments are whole numbers of intervals
+SHARD_THRESHOLD_SECONDS = 3 * 3600
+SEGMENT_SECONDS = 2 * 3600
+MAX_SEGMENTS = 16
+# Each segment after the first starts decoding this many intervals early so the
+# tracker is warmed up at the boundary; the warm-up intervals are dropped when
+# merging, so every crossing is counted by exactly one segment.
+OVERLAP_INTERVALS = 1
+
+MANIFEST_NAME = "segments.json"
+MERGED_REPORT_SUFFIX = "_merged_counts.txt"
+
+
+class ShardSubmissionError(Exception):
+    """Some segment jobs of a sharded video could not be started."""
+
+
+def should_shard(video_info):
+    return SHARDING_ENABLED and bool(video_info.get("duration_s")) and video_info["duration_s"] > SHARD_THRESHOLD_SECONDS
+
+
+def plan_segments(duration_s, segment_seconds=SEGMENT_SECONDS):
+    """Split ``duration_s`` into segments aligned to report intervals.
+
+    Returns a list of dicts with ``index``, ``start``/``end`` (the seconds the
+    segment owns in the original timeline), ``decode_start`` (``start`` minus
+    the warm-up overlap) and ``intervals`` (how many report intervals it owns).
+    """
+    total_intervals = math.ceil(duration_s / INTERVAL_SECONDS)
+    intervals_per_segment = max(1, segment_seconds // INTERVAL_SECONDS, math.ceil(total_intervals / MAX_SEGMENTS))
+    # Spread intervals evenly so the last segment isn't a short tail
+    segment_count = math.ceil(total_intervals / intervals_per_segment)
+    intervals_per_segment = math.ceil(total_intervals / segment_count)
+
+    segments = []
+    for index, first_interval in enumerate(range(0, total_intervals, intervals_per_segment)):
+        intervals = min(intervals_per_segment, total_intervals - first_interval)
+        start = first_interval * INTERVAL_SECONDS
+        overlap = OVERLAP_INTERVALS if index > 0 else 0
+        segments.append({
+            "index": index,
+            "start": start,
+            "end": min(duration_s, start + intervals * INTERVAL_SECONDS),
+            "decode_start": start - overlap * INTERVAL_SECONDS,
+            "intervals": intervals,
+        })
+    return segments
+
+
+def _segment_video_info(video_info, segment):
+    """Scale the probed video info down to one segment for planning.
+
+    Frames, duration and the rendered output scale with the segment, but
+    unless the container streams its input every segment job downloads the
+    whole video, so ``input_size`` stays the full size for volume sizing.
+    """
+    fraction = (segment["end"] - segment["decode_start"]) / video_info["duration_s"]
+    return {
+        "size": int(video_info["size"] * fraction),
+        "input_size": None if CONTAINER_STREAMS_VIDEO else video_info["size"],
+        "duration_s": segment["end"] - segment["decode_start"],
+        "frames": int(video_info["frames"] * fraction) if video_info.get("frames") else None,
+        "fps": video_info.get("fps"),
+    }
+
+
+def run_sharded(infile, video_info, write_video=True, bucket="jamar", segment_seconds=SEGMENT_SECONDS):
+    """Process a long video as parallel time segments.
+
+    Each segment job receives ``SEGMENT_START_SECONDS``/``SEGMENT_END_SECONDS``
+    and writes under ``<output>/segment_NNN/``. A ``segments.json`` manifest is
+    written to the output prefix so ``finalize_sharded_jobs`` can merge the
+    segment reports once every job has finished.
+
+    If any segment fails to start, the segments that did start are stopped,
+    no manifest is written and ``ShardSubmissionError`` is raised.
+
+    Returns the manifest dict.
+    """
+    datetime_str = datetime.datetime.now().strftime("%Y-%m-%d-%H-%M-%S")
+    base_filename = base_filename_for(infile)
+    output_prefix = f"outputs/{base_filename}_{datetime_str}"
+    segments = plan_segments(video_info["duration_s"], segment_seconds)
+
+    def submit(segment):
+        output_path = f"s3://{bucket}/{output_prefix}/segment_{segment['index']:03d}"
+        try:
+            plans = plan_submission(infile, write_video, bucket, video_info=_segment_video_info(video_info, segment))
+            plan, response = submit_with_plans(
+                infile, plans, write_video, job_suffix=f"s{segment['index']}", output_path=output_path,
+                extra_environment={
+                    "SEGMENT_START_SECONDS": str(segment["decode_start"]),
+                    "SEGMENT_END_SECONDS": str(segment["end"]),
+                },
+            )
+        except Exception as e:
+            logger.info(f"Failed to start segment {segment['index']} of {infile}. error: {e}")
+            return dict(segment, error=str(e))
+        return dict(segment, output_prefix=output_path.replace(f"s3://{bucket}/", ""), machine=plan["machine"],
+                    processing_job_name=response['ProcessingJobArn'].split('/')[-1])
+
+    with ThreadPoolExecutor(max_workers=len(segments)) as pool:
+        submitted = list(pool.map(submit, segments))
+
+    failed = [segment for segment in submitted if "error" in segment]
+    if failed:
+        started = [segment for segment in submitted if "error" not in segment]
+        _stop_jobs([segment["processing_job_name"] for segment in started])
+        raise ShardSubmissionError(
+            f"{len(failed)} of {len(segments)} segment jobs for {infile} failed to start ({failed[0]['error']}); "
+            f"the {len(started)} that started were stopped"
+        )
+
+    manifest = {
+        "infile": infile,
+        "every": EVERY,
+        "interval_seconds": INTERVAL_SECONDS,
+        "overlap_intervals": OVERLAP_INTERVALS,
+        "duration_s": video_info["duration_s"],
+        "merged_report_key": f"{output_prefix}/{base_filename}{MERGED_REPORT_SUFFIX}",
+        "segments": submitted,
+    }
+    get_client('s3').put_object(Bucket=bucket, Key=f"{output_prefix}/{MANIFEST_NAME}", Body=json.dumps(manifest, indent=2))
+    logger.info(f"Submitted {len(submitted)} segment jobs for {infile} under {output_prefix}")
+    return manifest
+
+
+def _stop_jobs(job_names):
+    sagemaker_client = get_client('sagemaker', region)
+    for job_name in job_names:
+        try:
+            sagemaker_client.stop_processing_job(ProcessingJobName=job_name)
+        except ClientError as e:
+            logger.error(f"Could not stop segment job {job_name}: {e}")
+
+
+def merge_segment_counts(segment_reports, segment_intervals, overlap_intervals=OVERLAP_INTERVALS):
+    """Merge per-segment count reports into one report on the original timeline.
+
+    ``segment_reports`` are the per-interval ``{movement: {class: count}}``
+    lists of each segment, in order; ``segment_intervals`` is how many
+    intervals each segment owns. The warm-up intervals at the start of every
+    segment after the first are dropped, and each segment is padded or
+    trimmed to the intervals it owns, so empty intervals keep their place.
+    """
+    merged = []
+    for index, (report, intervals) in enumerate(zip(segment_reports, segment_intervals)):
+        skip = overlap_intervals if index > 0 else 0
+        owned = list(report[skip:skip + intervals])
+        owned += [{} for _ in range(intervals - len(owned))]
+        merged.extend(owned)
+    return merged
+
+
+def _read_legacy_report(bucket, key):
+    body = get_client('s3').get_object(Bucket=bucket, Key=key)["Body"].read().decode("utf-8")
+    return parse_legacy_report(body)
+
+
+def _segment_report_key(bucket, segment_prefix):
+    for key in iter_files(bucket, f"{segment_prefix}/", 'txt'):
+        if 'crosswalk' not in key:
+            return key
+    return None
+
+
+def finalize_sharded_job(bucket, manifest_key):
+    """Merge the segment reports of one sharded job if they are all available.
+
+    Returns the merged report key, or None if some segments haven't finished.
+    """
+    s3_client = get_client('s3')
+    manifest = json.loads(s3_client.get_object(Bucket=bucket, Key=manifest_key)["Body"].read())
+
+    report_keys = [_segment_report_key(bucket, segment["output_prefix"]) for segment in manifest["segments"]]
+    if None in report_keys:
+        return None
+
+    merged = merge_segment_counts(
+        [_read_legacy_report(bucket, key) for key in report_keys],
+        [segment["intervals"] for segment in manifest["segments"]],
+        manifest.get("overlap_intervals", OVERLAP_INTERVALS),
+    )
+    response = s3_client.put_object(Bucket=bucket, Key=manifest["merged_report_key"], Body=repr(merged))
+    write_columnar_report(bucket, manifest["merged_report_key"], legacy_to_counts(merged), source_etag=response["ETag"])
+    logger.info(f"Merged {len(report_keys)} segment reports into {manifest['merged_report_key']}")
+    return manifest["merged_report_key"]
+
+
+def finalize_sharded_jobs(keys, bucket="jamar"):
+    """Merge every sharded job under ``outputs/`` whose merged report is missing.
+
+    ``keys`` is a listing of the ``outputs/`` prefix (e.g. from
+    ``list_files_indexed``). Returns the keys of newly merged reports.
+    """
+    merged_prefixes = {key.rsplit('/', 1)[0] for key in keys if key.endswith(MERGED_REPORT_SUFFIX)}
+    merged = []
+    for key in keys:
+        if not key.endswith(f"/{MANIFEST_NAME}") or key.rsplit('/', 1)[0] in merged_prefixes:
+            continue
+        merged_key = finalize_sharded_job(bucket, key)
+        if merged_key:
+            merged.append(merged_key)
+    return merged
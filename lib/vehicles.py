@@ -0,0 +1,151 @@
+import os
+import time
+
+import cv2
+import numpy as np
+
+from .aws import download_file
+from .models import get_model, get_model_lock, torch_memory_bytes
+
+MODEL_BUCKET = "traffmind-models"
+MODEL_REGION = "us-east-1"
+DETECTOR_PATH = "rtdetr-l.pt"
+CLASSIFIER_CONFIG = "./model/yolov8-cls.yaml"
+CLASSIFIER_CHECKPOINT = "./model/yolov8n-cls-20240508-002451.pt"
+CLASSIFIER_INPUT_SIZE = 256
+# Crops per forward pass; frames with more vehicles are split into several passes
+MAX_CLASSIFY_BATCH_SIZE = int(os.getenv("MAX_CLASSIFY_BATCH_SIZE", "32"))
+NORMALIZE_MEAN = (0.485, 0.456, 0.406)
+NORMALIZE_STD = (0.229, 0.224, 0.225)
+
+
+def default_device():
+    import torch
+
+    return 'cuda' if torch.cuda.is_available() else 'cpu'
+
+
+def _load_detector(path, device):
+    from ultralytics import RTDETR
+
+    if not os.path.exists(path):
+        download_file(MODEL_BUCKET, os.path.basename(path), path, region=MODEL_REGION)
+    detector = RTDETR(path)
+    detector.to(device)
+    return detector
+
+
+def _load_classifier(config, checkpoint, device):
+    import torch
+    from ultralytics import YOLO
+
+    state_dict = torch.load(checkpoint, map_location=device)
+    classifier = YOLO(config).model.model
+    classifier.to(device)
+    classifier.eval()
+    classifier.load_state_dict(state_dict)
+    if device == 'cpu':
+        classifier.to(memory_format=torch.channels_last)
+    return classifier
+
+
+def _detector_key(path, device):
+    return ("rtdetr", path, device)
+
+
+def get_detector(path=DETECTOR_PATH, device=None):
+    """Return the shared RT-DETR detector for ``path`` on ``device``, downloading the weights if needed.
+
+    The detector is not safe to call from several threads at once; run it
+    through ``detect``.
+    """
+    device = device or default_device()
+    return get_model(_detector_key(path, device), lambda: _load_detector(path, device),
+                     memory=lambda detector: torch_memory_bytes(detector.model))
+
+
+def detect(frame, path=DETECTOR_PATH, device=None):
+    """Run the shared detector on one BGR frame and return its ultralytics result.
+
+    Ultralytics keeps its predictor, with per-call batch and result state, on
+    the model instance, so calls from concurrent sessions take turns.
+    """
+    device = device or default_device()
+    detector = get_detector(path, device)
+    with get_model_lock(_detector_key(path, device)):
+        return detector(frame)[0]
+
+
+def get_classifier(config=CLASSIFIER_CONFIG, checkpoint=CLASSIFIER_CHECKPOINT, device=None):
+    """Return the shared YOLO crop classifier for ``checkpoint`` on ``device``, in eval mode."""
+    device = device or default_device()
+    return get_model(("yolo-cls", checkpoint, device), lambda: _load_classifier(config, checkpoint, device),
+                     memory=torch_memory_bytes)
+
+
+def crops_to_batch(crops, device, size=CLASSIFIER_INPUT_SIZE):
+    """Resize and normalise image crops into one ``(n, 3, size, size)`` float tensor.
+
+    Matches the old per-crop torchvision Resize/ToTensor/Normalize. Crops are
+    resized with OpenCV into one uint8 array, and the scaling and
+    normalisation run once on the whole batch.
+    """
+    import torch
+
+    resized = np.empty((len(crops), size, size, 3), dtype=np.uint8)
+    for i, crop in enumerate(crops):
+        resized[i] = cv2.resize(crop, (size, size), interpolation=cv2.INTER_AREA)
+    batch = torch.from_numpy(resized).to(device).permute(0, 3, 1, 2).float().div_(255)
+    mean = torch.tensor(NORMALIZE_MEAN, device=device).view(1, 3, 1, 1)
+    std = torch.tensor(NORMALIZE_STD, device=device).view(1, 3, 1, 1)
+    batch = (batch - mean) / std
+    if device == 'cpu':
+        batch = batch.contiguous(memory_format=torch.channels_last)
+    return batch
+
+
+def classify_crops(crops, classes, model=None, device=None, max_batch_size=MAX_CLASSIFY_BATCH_SIZE):
+    """Classify image crops, ``max_batch_size`` per forward pass, returning one class label per crop."""
+    import torch
+
+    if not crops:
+        return []
+    device = device or default_device()
+    model = model or get_classifier(device=device)
+    labels = []
+    with torch.inference_mode():
+        for start in range(0, len(crops), max_batch_size):
+            predictions = model(crops_to_batch(crops[start:start + max_batch_size], device))
+            if isinstance(predictions, (tuple, list)):
+                predictions = predictions[0]
+            labels.extend(classes[i] for i in predictions.argmax(dim=1).tolist())
+    return labels
+
+
+def benchmark_classification(classes, vehicle_counts=(1, 5, 10, 20, 50), repeats=5, device=None):
+    """Time ``classify_crops`` per frame against the number of vehicles in it.
+
+    Each count is timed batched and with ``max_batch_size=1``, which matches
+    the old one-crop-per-pass loop. Crops are random images of typical
+    vehicle sizes. Returns one dict per count with the best per-frame
+    milliseconds of each.
+    """
+    device = device or default_device()
+    model = get_classifier(device=device)
+    rng = np.random.default_rng(0)
+    results = []
+    for count in vehicle_counts:
+        crops = [rng.integers(0, 256, (int(rng.integers(40, 300)), int(rng.integers(40, 300)), 3), dtype=np.uint8)
+                 for _ in range(count)]
+        timings = {}
+        for label, batch_size in (("batched_ms", MAX_CLASSIFY_BATCH_SIZE), ("per_crop_ms", 1)):
+            classify_crops(crops, classes, model, device, batch_size)
+            best = None
+            for _ in range(repeats):
+                start = time.perf_counter()
+                classify_crops(crops, classes, model, device, batch_size)
+                elapsed = (time.perf_counter() - start) * 1000
+                best = elapsed if best is None else min(best, elapsed)
+            timings[label] = best
+        results.append({"vehicles": count, **timings})
+    return results
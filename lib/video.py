@@ -0,0 +1,360 @@
+import hashlib
+import logging
+import os
+import struct
+import tempfile
+
+import cv2
+import numpy as np
+import streamlit
+from botocore.exceptions import ClientError
+
+from .aws import get_client
+from .presign import presign
+
+logger = logging.getLogger(streamlit.__name__)
+
+FRAME_CACHE_DIR = os.getenv("FRAME_CACHE_DIR", os.path.expanduser("~/.cache/traffmind/first_frames"))
+FRAME_CACHE_MAX_ITEMS = int(os.getenv("FRAME_CACHE_MAX_ITEMS", "256"))
+
+# How much to read when walking top-level MP4 boxes, and how much past the
+# first video sample to fetch so decoders with reorder delay still emit a frame.
+HEADER_READ_SIZE = 64 * 1024
+# Box headers past the first read cost one ranged GET each, so the walk gives
+# up (and the caller falls back to streaming) after this many boxes.
+MAX_TOP_LEVEL_BOXES = 32
+SAMPLE_PREFETCH_SIZE = 2 * 1024 * 1024
+# Prefix sizes tried in turn for raw elementary streams (.h264)
+RAW_PREFIX_SIZES = [1024 * 1024, 4 * 1024 * 1024, 16 * 1024 * 1024]
+
+
+def thumbnail_key(key):
+    """S3 key of the persisted first frame for a video, next to its submission vectors."""
+    base_filename = key.split('/')[-1].rsplit('.', 1)[0]
+    return f"submissions/{base_filename}/first_frame.png"
+
+
+def _read_range(bucket, key, start, end):
+    """Read bytes ``start``..``end`` (inclusive) of an S3 object."""
+    s3_client = get_client("s3")
+    response = s3_client.get_object(Bucket=bucket, Key=key, Range=f"bytes={start}-{end}")
+    return response["Body"].read()
+
+
+def _parse_box_header(data, pos, limit):
+    """Return ``(box_type, header_size, box_size)`` for the box at ``data[pos:]``."""
+    size, box_type = struct.unpack(">I4s", data[pos:pos + 8])
+    header_size = 8
+    if size == 1:
+        size = struct.unpack(">Q", data[pos + 8:pos + 16])[0]
+        header_size = 16
+    elif size == 0:
+        size = limit - pos
+    return box_type, header_size, size
+
+
+def _top_level_boxes(bucket, key, total_size):
+    """Walk the top-level MP4 boxes with ranged reads.
+
+    Returns a list of ``(box_type, offset, size, header_bytes)``. Only box
+    headers are fetched, so a trailing ``moov`` behind a multi-GB ``mdat`` costs
+    one small extra request rather than a full download. The walk stops at
+    ``moov`` (only boxes already in the first read are listed past it), at the
+    first ``moof`` of a fragmented file, whose samples aren't indexed in
+    ``moov``, and after ``MAX_TOP_LEVEL_BOXES`` boxes.
+    """
+    boxes = []
+    buffer = _read_range(bucket, key, 0, min(HEADER_READ_SIZE, total_size) - 1)
+    pos = 0
+    found_moov = False
+    while pos + 8 <= total_size and len(boxes) < MAX_TOP_LEVEL_BOXES:
+        if pos + 16 > len(buffer):
+            if found_moov:
+                break
+            header = _read_range(bucket, key, pos, min(pos + 16, total_size) - 1)
+            box_type, header_size, size = _parse_box_header(header, 0, total_size - pos)
+        else:
+            header = buffer[pos:pos + 16]
+            box_type, header_size, size = _parse_box_header(buffer, pos, total_size)
+        if size < header_size:
+            break
+        boxes.append((box_type, pos, size, header[:header_size]))
+        if box_type == b"moof":
+            break
+        found_moov = found_moov or box_type == b"moov"
+        pos += size
+    return boxes
+
+
+def _child_boxes(data, start, end):
+    pos = start
+    while pos + 8 <= end:
+        box_type, header_size, size = _parse_box_header(data, pos, end)
+        if size < header_size:
+            return
+        yield box_type, pos + header_size, pos + size
+        pos += size
+
+
+def _find_box(data, start, end, path):
+    for box_type, payload_start, box_end in _child_boxes(data, start, end):
+        if box_type == path[0]:
+            if len(path) == 1:
+                return payload_start, box_end
+            return _find_box(data, payload_start, box_end, path[1:])
+    return None
+
+
+def _video_tracks(moov):
+    """Yield ``(trak_start, trak_end)`` for each video track in a ``moov`` payload."""
+    for box_type, trak_start, trak_end in _child_boxes(moov, 0, len(moov)):
+        if box_type != b"trak":
+            continue
+        hdlr = _find_box(moov, trak_start, trak_end, [b"mdia", b"hdlr"])
+        if hdlr is not None and moov[hdlr[0] + 8:hdlr[0] + 12] == b"vide":
+            yield trak_start, trak_end
+
+
+def _sample_count(moov, stbl):
+    stsz = _find_box(moov, stbl[0], stbl[1], [b"stsz"])
+    if stsz is None:
+        return None
+    return struct.unpack(">I", moov[stsz[0] + 8:stsz[0] + 12])[0]
+
+
+def _first_video_sample(moov):
+    """Return ``(offset, size)`` of the first sample of the first video track in ``moov``."""
+    for trak_start, trak_end in _video_tracks(moov):
+        stbl = _find_box(moov, trak_start, trak_end, [b"mdia", b"minf", b"stbl"])
+        if stbl is None:
+            continue
+        stsz = _find_box(moov, stbl[0], stbl[1], [b"stsz"])
+        stco = _find_box(moov, stbl[0], stbl[1], [b"stco"])
+        co64 = _find_box(moov, stbl[0], stbl[1], [b"co64"])
+        if stsz is None or (stco is None and co64 is None):
+            continue
+
+        sample_size, sample_count = struct.unpack(">II", moov[stsz[0] + 4:stsz[0] + 12])
+        if sample_count == 0:
+            continue
+        if sample_size == 0:
+            sample_size = struct.unpack(">I", moov[stsz[0] + 12:stsz[0] + 16])[0]
+
+        if stco is not None:
+            chunk_count = struct.unpack(">I", moov[stco[0] + 4:stco[0] + 8])[0]
+            offset = struct.unpack(">I", moov[stco[0] + 8:stco[0] + 12])[0] if chunk_count else None
+        else:
+            chunk_count = struct.unpack(">I", moov[co64[0] + 4:co64[0] + 8])[0]
+            offset = struct.unpack(">Q", moov[co64[0] + 8:co64[0] + 16])[0] if chunk_count else None
+        if offset is None:
+            continue
+        return offset, sample_size
+    return None
+
+
+def _video_duration_and_frames(moov):
+    """Return ``(duration_s, frames)`` of the first video track in ``moov``, or None."""
+    for trak_start, trak_end in _video_tracks(moov):
+        mdhd = _find_box(moov, trak_start, trak_end, [b"mdia", b"mdhd"])
+        stbl = _find_box(moov, trak_start, trak_end, [b"mdia", b"minf", b"stbl"])
+        if mdhd is None or stbl is None:
+            continue
+        if moov[mdhd[0]] == 1:
+            timescale, duration = struct.unpack(">IQ", moov[mdhd[0] + 20:mdhd[0] + 32])
+        else:
+            timescale, duration = struct.unpack(">II", moov[mdhd[0] + 12:mdhd[0] + 20])
+        frames = _sample_count(moov, stbl)
+        if not timescale or not frames:
+            continue
+        return duration / timescale, frames
+    return None
+
+
+def _decode_first_frame(path):
+    cap = cv2.VideoCapture(path)
+    ret, frame = cap.read()
+    cap.release()
+    return frame if ret and frame is not None else None
+
+
+def _read_moov(bucket, key, total_size):
+    """Return ``(boxes, moov_box, moov_payload)``; ``moov_box`` is None if there is no index."""
+    boxes = _top_level_boxes(bucket, key, total_size)
+    moov_box = next((box for box in boxes if box[0] == b"moov"), None)
+    if moov_box is None:
+        return boxes, None, None
+    _, moov_offset, moov_size, moov_header = moov_box
+    moov = _read_range(bucket, key, moov_offset + len(moov_header), moov_offset + moov_size - 1)
+    return boxes, moov_box, moov
+
+
+def _extract_mp4_first_frame(bucket, key, total_size):
+    """Decode the first frame of an MP4/MOV from the container index and first sample only.
+
+    The fetched ranges (top-level box headers, ``ftyp``, ``moov`` and the first
+    video sample) are written at their original offsets into a sparse local
+    file of the original length, which OpenCV then opens as if it were whole.
+    """
+    boxes, moov_box, moov = _read_moov(bucket, key, total_size)
+    if moov_box is None:
+        return None
+
+    _, moov_offset, moov_size, moov_header = moov_box
+    sample = _first_video_sample(moov)
+    if sample is None:
+        return None
+    sample_offset, sample_size = sample
+    sample_end = min(sample_offset + sample_size + SAMPLE_PREFETCH_SIZE, total_size)
+
+    with tempfile.NamedTemporaryFile(suffix=f".{key.rsplit('.', 1)[-1]}") as f:
+        f.truncate(total_size)
+        for box_type, offset, size, header in boxes:
+            f.seek(offset)
+            f.write(header)
+            if box_type == b"ftyp":
+                f.write(_read_range(bucket, key, offset + len(header), offset + size - 1))
+        f.seek(moov_offset + len(moov_header))
+        f.write(moov)
+        f.seek(sample_offset)
+        f.write(_read_range(bucket, key, sample_offset, sample_end - 1))
+        f.flush()
+        return _decode_first_frame(f.name)
+
+
+def _extract_raw_first_frame(bucket, key, total_size):
+    """Decode the first frame of a raw elementary stream from a growing prefix."""
+    for prefix_size in RAW_PREFIX_SIZES:
+        prefix_size = min(prefix_size, total_size)
+        with tempfile.NamedTemporaryFile(suffix=f".{key.rsplit('.', 1)[-1]}") as f:
+            f.write(_read_range(bucket, key, 0, prefix_size - 1))
+            f.flush()
+            frame = _decode_first_frame(f.name)
+        if frame is not None or prefix_size == total_size:
+            return frame
+    return None
+
+
+def _extract_streamed_first_frame(bucket, key):
+    """Fallback: let OpenCV stream the object through a presigned URL."""
+    url = presign(bucket, key, 7600)
+    logger.warning(f"capturing video from presigned url for {bucket}/{key}")
+    return _decode_first_frame(url)
+
+
+def extract_first_frame_ranged(bucket, key, total_size):
+    """Extract the first frame using ranged reads, falling back to streaming the object."""
+    extension = key.rsplit('.', 1)[-1].lower()
+    frame = None
+    if total_size == 0:
+        return None
+    try:
+        if extension in ("mp4", "mov", "m4v"):
+            frame = _extract_mp4_first_frame(bucket, key, total_size)
+        elif extension in ("h264", "264", "h265", "265"):
+            frame = _extract_raw_first_frame(bucket, key, total_size)
+    except (ClientError, struct.error, ValueError) as e:
+        logger.warning(f"Ranged first-frame extraction failed for {bucket}/{key}: {e}")
+    if frame is None:
+        frame = _extract_streamed_first_frame(bucket, key)
+    return frame
+
+
+def probe_video(bucket, key):
+    """Return ``{"size", "duration_s", "frames", "fps"}`` for a video in S3.
+
+    For MP4/MOV the duration and frame count come from the ``moov`` index via
+    ranged reads; for other formats only ``size`` is known and the rest are None.
+    """
+    s3_client = get_client("s3")
+    total_size = s3_client.head_object(Bucket=bucket, Key=key)["ContentLength"]
+    info = {"size": total_size, "duration_s": None, "frames": None, "fps": None}
+    if total_size == 0 or key.rsplit('.', 1)[-1].lower() not in ("mp4", "mov", "m4v"):
+        return info
+    try:
+        _, moov_box, moov = _read_moov(bucket, key, total_size)
+        track = _video_duration_and_frames(moov) if moov_box is not None else None
+    except (ClientError, struct.error, ValueError) as e:
+        logger.warning(f"Could not probe {bucket}/{key}: {e}")
+        track = None
+    if track is not None:
+        duration_s, frames = track
+        info.update(duration_s=duration_s, frames=frames, fps=frames / duration_s if duration_s else None)
+    return info
+
+
+def _frame_cache_path(cache_key):
+    return os.path.join(FRAME_CACHE_DIR, hashlib.sha1(cache_key.encode("utf-8")).hexdigest() + ".png")
+
+
+def _frame_cache_get(cache_key):
+    path = _frame_cache_path(cache_key)
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+    # Touch so eviction drops the least recently used frames first
+    os.utime(path)
+    return data
+
+
+def _frame_cache_put(cache_key, png_bytes):
+    os.makedirs(FRAME_CACHE_DIR, exist_ok=True)
+    path = _frame_cache_path(cache_key)
+    fd, tmp_path = tempfile.mkstemp(dir=FRAME_CACHE_DIR, suffix=".tmp")
+    with os.fdopen(fd, "wb") as f:
+        f.write(png_bytes)
+    os.replace(tmp_path, path)
+
+    entries = [os.path.join(FRAME_CACHE_DIR, name) for name in os.listdir(FRAME_CACHE_DIR) if name.endswith(".png")]
+    if len(entries) > FRAME_CACHE_MAX_ITEMS:
+        entries.sort(key=os.path.getmtime)
+        for stale in entries[:len(entries) - FRAME_CACHE_MAX_ITEMS]:
+            try:
+                os.remove(stale)
+            except OSError:
+                pass
+
+
+def _decode_png(png_bytes):
+    return cv2.imdecode(np.frombuffer(png_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def get_first_frame(bucket, key):
+    """Return the first frame of ``bucket/key`` as a BGR array, or None.
+
+    Lookups go local disk LRU -> persisted ``submissions/<name>/first_frame.png``
+    in S3 -> ranged extraction. Both caches are keyed on the video's ETag, so a
+    re-uploaded video with the same name gets a fresh frame.
+    """
+    s3_client = get_client("s3")
+    head = s3_client.head_object(Bucket=bucket, Key=key)
+    etag = head["ETag"].strip('"')
+    cache_key = f"{bucket}/{key}/{etag}"
+
+    png_bytes = _frame_cache_get(cache_key)
+    if png_bytes is not None:
+        return _decode_png(png_bytes)
+
+    thumb_key = thumbnail_key(key)
+    try:
+        thumb = s3_client.get_object(Bucket=bucket, Key=thumb_key)
+        if thumb.get("Metadata", {}).get("source-etag") == etag:
+            png_bytes = thumb["Body"].read()
+            _frame_cache_put(cache_key, png_bytes)
+            return _decode_png(png_bytes)
+    except ClientError as e:
+        if e.response["Error"]["Code"] not in ("NoSuchKey", "404"):
+            raise
+
+    frame = extract_first_frame_ranged(bucket, key, head["ContentLength"])
+    if frame is None:
+        return None
+
+    ok, encoded = cv2.imencode(".png", frame)
+    if ok:
+        png_bytes = encoded.tobytes()
+        s3_client.put_object(Bucket=bucket, Key=thumb_key, Body=png_bytes, ContentType="image/png",
+                             Metadata={"source-etag": etag})
+        _frame_cache_put(cache_key, png_bytes)
+    return frame
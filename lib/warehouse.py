@@ -0,0 +1,213 @@
+import csv
+import datetime
+import io
+import logging
+import re
+
+import pandas as pd
+import streamlit
+from sqlalchemy import bindparam, inspect, text
+
+from .aws import get_listing_index
+from .db import get_engine
+from .reports import load_report
+
+logger = logging.getLogger(streamlit.__name__)
+
+# One row per ingested report, and its counts in long form. Jobs carry the
+# site (the video's base name) and when they started; each count carries its
+# interval both as minutes from the start of the video and as a timestamp.
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS report_jobs (
+        job TEXT PRIMARY KEY,
+        file_name TEXT NOT NULL,
+        site TEXT,
+        started_at TIMESTAMP,
+        etag TEXT,
+        interval_minutes INTEGER NOT NULL,
+        ingested_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS report_counts (
+        job TEXT NOT NULL REFERENCES report_jobs (job) ON DELETE CASCADE,
+        interval_start INTEGER NOT NULL,
+        interval_time TIMESTAMP,
+        movement TEXT NOT NULL,
+        class SMALLINT NOT NULL,
+        count INTEGER NOT NULL,
+        PRIMARY KEY (job, interval_start, movement, class)
+    )
+    """,
+]
+# Columns added after the tables were first created, for existing warehouses
+ADDED_COLUMNS = {
+    "report_jobs": {"site": "TEXT", "started_at": "TIMESTAMP"},
+    "report_counts": {"interval_time": "TIMESTAMP"},
+}
+INDEXES = [
+    "CREATE INDEX IF NOT EXISTS report_counts_movement_class_idx ON report_counts (movement, class)",
+    "CREATE INDEX IF NOT EXISTS report_counts_interval_idx ON report_counts (interval_start)",
+    "CREATE INDEX IF NOT EXISTS report_counts_interval_time_idx ON report_counts (interval_time)",
+    "CREATE INDEX IF NOT EXISTS report_jobs_site_idx ON report_jobs (site)",
+]
+
+COUNT_COLUMNS = ["job", "interval_start", "interval_time", "movement", "class", "count"]
+# Columns aggregate_counts can group by, and the SQL for each
+GROUP_EXPRESSIONS = {
+    "site": "j.site",
+    "date": "DATE(c.interval_time)",
+    "job": "c.job",
+    "interval_start": "c.interval_start",
+    "movement": "c.movement",
+    "class": "c.class",
+}
+GROUP_COLUMNS = tuple(GROUP_EXPRESSIONS)
+# Job output prefixes are outputs/<video base name>_<submission time>/
+JOB_PREFIX_PATTERN = re.compile(r"^(?P<site>.+)_(?P<started>\d{4}-\d{2}-\d{2}-\d{2}-\d{2}-\d{2})$")
+
+
+def job_site_and_start(report_key, last_modified=None):
+    """Return ``(site, started_at)`` for a report from its job's output prefix.
+
+    Reports outside a ``<video>_<timestamp>`` prefix fall back to the prefix
+    name and ``last_modified``.
+    """
+    parts = report_key.split('/')
+    job_prefix = parts[1] if len(parts) > 2 else parts[-1].rsplit('.', 1)[0]
+    match = JOB_PREFIX_PATTERN.match(job_prefix)
+    if match is None:
+        return job_prefix, last_modified
+    return match["site"], datetime.datetime.strptime(match["started"], "%Y-%m-%d-%H-%M-%S")
+
+
+def create_schema(engine=None):
+    engine = engine or get_engine()
+    with engine.begin() as connection:
+        for statement in SCHEMA:
+            connection.execute(text(statement))
+        inspector = inspect(connection)
+        for table, columns in ADDED_COLUMNS.items():
+            existing = {column["name"] for column in inspector.get_columns(table)}
+            for column, column_type in columns.items():
+                if column not in existing:
+                    connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}"))
+        for statement in INDEXES:
+            connection.execute(text(statement))
+
+
+def _copy_rows(connection, rows):
+    """Bulk load ``rows`` into report_counts with COPY on Postgres, executemany elsewhere."""
+    if connection.dialect.name == "postgresql":
+        buffer = io.StringIO()
+        csv.writer(buffer).writerows(rows)
+        buffer.seek(0)
+        cursor = connection.connection.cursor()
+        cursor.copy_expert(f"COPY report_counts ({', '.join(COUNT_COLUMNS)}) FROM STDIN WITH (FORMAT csv)", buffer)
+        cursor.close()
+    else:
+        connection.execute(
+            text(f"INSERT INTO report_counts ({', '.join(COUNT_COLUMNS)}) VALUES ({', '.join(f':{column}' for column in COUNT_COLUMNS)})"),
+            [dict(zip(COUNT_COLUMNS, row)) for row in rows],
+        )
+
+
+def ingest_report(bucket, report_key, etag=None, engine=None, last_modified=None):
+    """Load one report into the warehouse, replacing any earlier copy of it.
+
+    The job is identified by its report key; its site and start time come
+    from ``job_site_and_start``. Returns the number of count rows.
+    """
+    engine = engine or get_engine()
+    counts, interval_minutes = load_report(bucket, report_key)
+    counts = counts[counts["count"] != 0]
+    site, started_at = job_site_and_start(report_key, last_modified)
+    interval_starts = (counts["interval"].to_numpy() * interval_minutes).tolist()
+    rows = zip(
+        [report_key] * len(counts),
+        interval_starts,
+        [started_at + datetime.timedelta(minutes=minutes) if started_at else None for minutes in interval_starts],
+        counts["movement"].tolist(),
+        counts["class"].tolist(),
+        counts["count"].tolist(),
+    )
+
+    with engine.begin() as connection:
+        connection.execute(text("DELETE FROM report_counts WHERE job = :job"), {"job": report_key})
+        connection.execute(text("DELETE FROM report_jobs WHERE job = :job"), {"job": report_key})
+        connection.execute(
+            text("INSERT INTO report_jobs (job, file_name, site, started_at, etag, interval_minutes) "
+                 "VALUES (:job, :file_name, :site, :started_at, :etag, :interval_minutes)"),
+            {"job": report_key, "file_name": report_key.split('/')[-1], "site": site, "started_at": started_at,
+             "etag": etag, "interval_minutes": interval_minutes},
+        )
+        _copy_rows(connection, list(rows))
+    return len(counts)
+
+
+def ingest_new_reports(bucket, report_keys, prefix="outputs/", engine=None):
+    """Ingest reports that are new, whose ETag changed, or that were ingested before sites were recorded.
+
+    Returns the keys that were ingested.
+    """
+    engine = engine or get_engine()
+    create_schema(engine)
+    entries = {entry["Key"]: entry for entry in get_listing_index(bucket, prefix).entries()}
+    with engine.connect() as connection:
+        ingested = dict(connection.execute(text("SELECT job, etag FROM report_jobs WHERE site IS NOT NULL")).fetchall())
+
+    to_ingest = [key for key in report_keys if key not in ingested or ingested[key] != entries.get(key, {}).get("ETag")]
+    for key in to_ingest:
+        entry = entries.get(key, {})
+        rows = ingest_report(bucket, key, entry.get("ETag"), engine, entry.get("LastModified"))
+        logger.info(f"Ingested {rows} count rows from {key}")
+    return to_ingest
+
+
+def aggregate_counts(jobs=None, group_by=("movement", "class"), sites=None, start_date=None, end_date=None,
+                     engine=None):
+    """Sum counts across jobs in one query.
+
+    ``group_by`` is any subset of ``GROUP_COLUMNS``: ``site``, ``date`` (the
+    calendar day of each interval), ``job``, ``interval_start``, ``movement``
+    and ``class``. ``jobs`` and ``sites`` restrict the query to those report
+    keys and sites, and ``start_date``/``end_date`` (inclusive dates) to
+    intervals on those days.
+    """
+    group_by = [column for column in group_by if column in GROUP_COLUMNS]
+    if not group_by:
+        raise ValueError(f"group_by must include one of {', '.join(GROUP_COLUMNS)}")
+    expressions = [GROUP_EXPRESSIONS[column] for column in group_by]
+    query = (f"SELECT {', '.join(f'{expression} AS {column}' for expression, column in zip(expressions, group_by))}, "
+             "SUM(c.count) AS count FROM report_counts c JOIN report_jobs j ON j.job = c.job WHERE 1 = 1")
+    params = {}
+    expanding = []
+    if jobs:
+        query += " AND c.job IN :jobs"
+        params["jobs"] = list(jobs)
+        expanding.append("jobs")
+    if sites:
+        query += " AND j.site IN :sites"
+        params["sites"] = list(sites)
+        expanding.append("sites")
+    if start_date is not None:
+        query += " AND c.interval_time >= :start_time"
+        params["start_time"] = datetime.datetime.combine(start_date, datetime.time.min)
+    if end_date is not None:
+        query += " AND c.interval_time < :end_time"
+        params["end_time"] = datetime.datetime.combine(end_date + datetime.timedelta(days=1), datetime.time.min)
+    query += f" GROUP BY {', '.join(expressions)} ORDER BY {', '.join(expressions)}"
+    statement = text(query)
+    if expanding:
+        statement = statement.bindparams(*[bindparam(name, expanding=True) for name in expanding])
+
+    with (engine or get_engine()).connect() as connection:
+        result = connection.execute(statement, params)
+        return pd.DataFrame(result.fetchall(), columns=list(result.keys()))
+
+
+def warehouse_sites(engine=None):
+    """Sites with ingested reports, sorted."""
+    with (engine or get_engine()).connect() as connection:
+        return [row[0] for row in connection.execute(text("SELECT DISTINCT site FROM report_jobs WHERE site IS NOT NULL ORDER BY site"))]
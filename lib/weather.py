@@ -0,0 +1,274 @@
+import io
+import time
+import zipfile
+
+import cv2
+import numpy as np
+import pandas as pd
+from PIL import Image, ImageOps
+
+from .models import get_model
+from .presign import presign
+from .reports import INTERVAL_MINUTES
+
+WEATHER_MODEL_PATH = "./model/traffmind_weather_beta1.h5"
+WEATHER_CLASSES = ['Cloudy', 'Sunny', 'Rainy', 'Snowy', 'Foggy']
+INPUT_SIZE = 100
+PREDICT_BATCH_SIZE = 32
+IMAGE_TYPES = ("jpg", "jpeg", "png")
+# Where in each count interval the timeline frame is taken, as a fraction of it
+TIMELINE_SAMPLE_POSITION = 0.5
+# Fallback for streams that don't report a frame rate
+DEFAULT_FPS = 30.0
+VIDEO_URL_EXPIRATION = 7600
+
+
+def preprocess_image_for_prediction(image):
+    # Read the image in grayscale mode
+    temp_image = np.array(image.convert('L'))
+    edges = cv2.Canny(temp_image, 150, 300)
+    shape = np.shape(edges)
+    left = np.sum(edges[0:shape[0] // 2, 0:shape[1] // 2])
+    right = np.sum(edges[0:shape[0] // 2, shape[1] // 2:])
+
+    if right > left:
+        sky_side = 0
+    else:
+        sky_side = 1
+
+    base_height = 400
+    wpercent = (base_height / float(image.size[1]))
+    wsize = int((float(image.size[0]) * float(wpercent)))
+    image = image.resize((wsize, base_height), Image.Resampling.LANCZOS)
+
+    if image.size[0] >= image.size[1]:
+        if sky_side == 0:
+            image = image.crop((0, 0, base_height, image.size[1]))
+        else:
+            image = image.crop((image.size[0] - base_height, 0, image.size[0], image.size[1]))
+    else:
+        base_width = 400
+        wpercent = (base_width / float(image.size[0]))
+        hsize = int((float(image.size[1]) * float(wpercent)))
+        image = image.resize((base_width, hsize), Image.Resampling.LANCZOS)
+        image = image.crop((0, 0, image.size[0], 400))
+
+    image = ImageOps.invert(image)
+    image = image.resize((100, 100), Image.Resampling.LANCZOS)
+    img_array = np.array(image) / 255.0
+    img_array = np.expand_dims(img_array, axis=0)
+
+    return img_array
+
+
+def _as_rgb_array(image):
+    if isinstance(image, np.ndarray):
+        if image.ndim == 2:
+            return cv2.cvtColor(image, cv2.COLOR_GRAY2RGB)
+        return image[..., :3]
+    return np.asarray(image.convert('RGB'))
+
+
+def sky_side(rgb):
+    """0 if the top-left quadrant has fewer edges than the top-right, else 1.
+
+    The decision of ``preprocess_image_for_prediction``: Canny runs on the
+    full-resolution image, converted to grayscale the way PIL does, and
+    edges are counted in its top half. Downscaling first, or running Canny
+    on the top half alone, moves edges across the threshold and can flip it.
+    """
+    gray = np.asarray(Image.fromarray(rgb).convert('L'))
+    edges = cv2.Canny(gray, 150, 300)
+    height, width = edges.shape
+    left = np.count_nonzero(edges[:height // 2, :width // 2])
+    right = np.count_nonzero(edges[:height // 2, width // 2:])
+    return 0 if right > left else 1
+
+
+def preprocess_array(image):
+    """Preprocess one image (PIL or RGB array) into a ``(100, 100, 3)`` float32 array.
+
+    Crops the same region as ``preprocess_image_for_prediction``: its
+    resize-to-400 then 400-pixel crop selects a square of side
+    min(width, height) from the original, at the left or right edge (by sky
+    side) for landscape images or at the top for portrait ones. That square is
+    cropped as a view and resized to the input size in one area-averaged step,
+    then inverted on the small array. The resampling differs from the legacy
+    two Lanczos resizes, so pixel values differ slightly; ``compare_preprocessing``
+    measures by how much.
+    """
+    rgb = _as_rgb_array(image)
+    height, width = rgb.shape[:2]
+    if width >= height:
+        crop = rgb[:, :height] if sky_side(rgb) == 0 else rgb[:, width - height:]
+    else:
+        crop = rgb[:width]
+    small = cv2.resize(crop, (INPUT_SIZE, INPUT_SIZE), interpolation=cv2.INTER_AREA)
+    return (255 - small).astype(np.float32) / 255.0
+
+
+def preprocess_images(images):
+    """Preprocess a batch of images into one ``(n, 100, 100, 3)`` float32 array."""
+    batch = np.empty((len(images), INPUT_SIZE, INPUT_SIZE, 3), dtype=np.float32)
+    for i, image in enumerate(images):
+        batch[i] = preprocess_array(image)
+    return batch
+
+
+def compare_preprocessing(images, repeats=3):
+    """Check ``preprocess_images`` against ``preprocess_image_for_prediction`` and time both.
+
+    Returns the largest per-pixel difference, the mean absolute difference,
+    and milliseconds per image for each pipeline (best of ``repeats``).
+    """
+    pil_images = [Image.fromarray(_as_rgb_array(image)) for image in images]
+
+    def best_of(fn):
+        best, result = None, None
+        for _ in range(repeats):
+            start = time.perf_counter()
+            result = fn()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        return best * 1000 / len(images), result
+
+    legacy_ms, legacy = best_of(lambda: np.concatenate([preprocess_image_for_prediction(image) for image in pil_images]))
+    batch_ms, batch = best_of(lambda: preprocess_images(images))
+    difference = np.abs(legacy - batch)
+    return {
+        "max_difference": float(difference.max()),
+        "mean_difference": float(difference.mean()),
+        "legacy_ms_per_image": legacy_ms,
+        "batch_ms_per_image": batch_ms,
+    }
+
+
+def _load_weather_model(path):
+    import tensorflow as tf
+
+    return tf.keras.models.load_model(path)
+
+
+def _warm_up(model):
+    model.predict(np.zeros((1, INPUT_SIZE, INPUT_SIZE, 3), dtype=np.float32), verbose=0)
+
+
+def get_weather_model(path=WEATHER_MODEL_PATH):
+    """Return the shared, warmed-up weather model."""
+    return get_model(("keras", path), lambda: _load_weather_model(path), _warm_up)
+
+
+def predict_weather(images, batch_size=PREDICT_BATCH_SIZE):
+    """Classify PIL images or RGB arrays, ``batch_size`` at a time.
+
+    Returns ``(results, stats)``: one ``{"prediction", "confidence"}`` dict per
+    image in order, and the preprocessing and inference time with throughput.
+    """
+    model = get_weather_model()
+    start = time.perf_counter()
+    batch = preprocess_images(images)
+    preprocess_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    predictions = model.predict(batch, batch_size=batch_size, verbose=0)
+    predict_seconds = time.perf_counter() - start
+
+    results = [{"prediction": WEATHER_CLASSES[int(np.argmax(p))], "confidence": float(np.max(p))} for p in predictions]
+    total = preprocess_seconds + predict_seconds
+    stats = {
+        "images": len(images),
+        "preprocess_seconds": preprocess_seconds,
+        "predict_seconds": predict_seconds,
+        "images_per_second": len(images) / total if total else 0.0,
+    }
+    return results, stats
+
+
+def open_uploaded_images(uploaded_files):
+    """Yield ``(name, PIL image)`` for uploaded images and the images inside uploaded zips."""
+    for uploaded in uploaded_files:
+        if uploaded.name.lower().endswith(".zip"):
+            with zipfile.ZipFile(uploaded) as archive:
+                for name in sorted(archive.namelist()):
+                    if name.lower().endswith(IMAGE_TYPES) and not name.startswith("__MACOSX/"):
+                        yield name, Image.open(io.BytesIO(archive.read(name)))
+        else:
+            yield uploaded.name, Image.open(uploaded)
+
+
+def sample_interval_frames(source, interval_minutes=INTERVAL_MINUTES):
+    """Yield ``(interval, RGB frame)`` with one frame from each count interval of a video.
+
+    ``source`` is a local path or a URL (a presigned S3 URL streams with
+    ranged reads). Containers with an index are seeked straight to each
+    sample time, so only the frames around it are decoded. Raw streams can't
+    seek, so frames up to each sample are grabbed without being converted.
+    """
+    capture = cv2.VideoCapture(source)
+    if not capture.isOpened():
+        raise ValueError(f"Could not open video {source}")
+    try:
+        fps = capture.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+        frame_count = capture.get(cv2.CAP_PROP_FRAME_COUNT)
+        seekable = frame_count > 0
+        duration_ms = frame_count / fps * 1000 if seekable else None
+        interval_ms = interval_minutes * 60 * 1000
+        position = 0
+
+        interval = 0
+        while True:
+            start_ms = interval * interval_ms
+            if duration_ms is not None and start_ms >= duration_ms:
+                return
+            sample_ms = start_ms + interval_ms * TIMELINE_SAMPLE_POSITION
+            if duration_ms is not None:
+                # A short last interval is sampled at its middle instead
+                sample_ms = min(sample_ms, (start_ms + duration_ms) / 2)
+
+            if seekable:
+                capture.set(cv2.CAP_PROP_POS_MSEC, sample_ms)
+            else:
+                target = int(sample_ms / 1000 * fps)
+                while position < target and capture.grab():
+                    position += 1
+            ok, frame = capture.read()
+            position += 1
+            if not ok:
+                return
+            yield interval, cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            interval += 1
+    finally:
+        capture.release()
+
+
+def weather_timeline(source, interval_minutes=INTERVAL_MINUTES, batch_size=PREDICT_BATCH_SIZE):
+    """Predict the weather for each count interval of a video.
+
+    Returns a frame with ``From``/``To`` labelled like the Step 4 report,
+    plus ``Prediction`` and ``Confidence``. Frames go through the model
+    ``batch_size`` at a time, so memory stays flat for long videos.
+    """
+    model = get_weather_model()
+    rows = []
+
+    def flush(batch):
+        predictions = model.predict(preprocess_images([frame for _, frame in batch]), batch_size=batch_size, verbose=0)
+        for (interval, _), p in zip(batch, predictions):
+            start = interval * interval_minutes
+            rows.append({"interval": interval, "From": f"{start} min", "To": f"{start + interval_minutes} min",
+                         "Prediction": WEATHER_CLASSES[int(np.argmax(p))], "Confidence": float(np.max(p))})
+
+    batch = []
+    for sample in sample_interval_frames(source, interval_minutes):
+        batch.append(sample)
+        if len(batch) == batch_size:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+    return pd.DataFrame(rows, columns=["interval", "From", "To", "Prediction", "Confidence"])
+
+
+def s3_weather_timeline(bucket, key, interval_minutes=INTERVAL_MINUTES):
+    """``weather_timeline`` for a video in S3, streamed through a presigned URL."""
+    return weather_timeline(presign(bucket, key, VIDEO_URL_EXPIRATION), interval_minutes)
@@ -1,9 +1,10 @@
 import streamlit as st
 import logging
-import boto3
-from botocore.exceptions import NoCredentialsError
-from lib.aws import send_discord_notification
+from botocore.exceptions import NoCredentialsError, ClientError
+from lib.aws import send_discord_notification, get_listing_index
+from lib.multipart_upload import upload_fileobj_multipart
 import os
+import uuid
 
 # Initialize logger
 logger = logging.getLogger(__name__)
@@ -12,10 +13,10 @@ logger = logging.getLogger(__name__)
 st.set_page_config(layout="wide")
 
 # AWS S3 configuration
-AWS_ACCESS_KEY = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
 S3_BUCKET = 'jamar'
 UPLOAD_FOLDER = 'client_upload/'
+UPLOAD_PART_SIZE_MB = int(os.getenv("UPLOAD_PART_SIZE_MB", "16"))
+UPLOAD_MAX_WORKERS = int(os.getenv("UPLOAD_MAX_WORKERS", "8"))
 
 logger.warning("test4")
 
@@ -24,16 +25,29 @@ def upload_to_s3(file, bucket, folder, object_name=None):
     if object_name is None:
         object_name = folder + file.name
 
-    s3_client = boto3.client(
-        's3',
-        aws_access_key_id=AWS_ACCESS_KEY,
-        aws_secret_access_key=AWS_SECRET_KEY
-    )
+    progress_bar = st.progress(0.0, text=f"Uploading {file.name}...")
+
+    def show_progress(bytes_done, total_size):
+        fraction = bytes_done / total_size if total_size else 1.0
+        progress_bar.progress(fraction, text=f"Uploading {file.name}: {bytes_done / (1024 * 1024):,.0f} of {total_size / (1024 * 1024):,.0f} MB")
 
     try:
-        s3_client.upload_fileobj(file, bucket, object_name)
+        result = upload_fileobj_multipart(
+            file, bucket, object_name, file.size,
+            part_size=UPLOAD_PART_SIZE_MB * 1024 * 1024,
+            max_workers=UPLOAD_MAX_WORKERS,
+            progress_callback=show_progress,
+            # Lets a retry from this session resume straight away
+            owner=st.session_state.setdefault('upload_owner', uuid.uuid4().hex),
+        )
+        if result["resumed_parts"]:
+            logger.warning(f"Resumed upload of {object_name}: {result['resumed_parts']} of {result['parts']} parts were already stored")
+        logger.warning(f"Uploaded {object_name} with checksum {result['checksum_sha256']}")
+        # Show the upload at once instead of after the next shared listing refresh
+        get_listing_index(bucket, folder).add(object_name, file.size, result["etag"])
         return True
-    except NoCredentialsError:
+    except (NoCredentialsError, ClientError) as e:
+        logger.warning(f"Failed to upload {object_name}: {e}")
         return False
 
 # Header
@@ -49,6 +63,7 @@ You can now directly upload your videos through this page. Follow the steps belo
 
 2. **Upload Video**:
     - After selecting the video file, it will automatically start uploading.
+    - If the upload is interrupted, select the same file again and it will pick up where it left off.
 """)
 
 uploaded_file = st.file_uploader("Choose a video file", type=["mp4", "h264"], accept_multiple_files=False)
@@ -56,8 +71,11 @@ uploaded_file = st.file_uploader("Choose a video file", type=["mp4", "h264"], ac
 if uploaded_file is not None:
     if uploaded_file.size > 25 * 1024 * 1024 * 1024:
         st.error("File size exceeds 25 GB limit.")
+    elif st.session_state.get('uploaded_file') == (uploaded_file.name, uploaded_file.size):
+        st.success(f"File {uploaded_file.name} uploaded successfully!")
     else:
         if upload_to_s3(uploaded_file, S3_BUCKET, UPLOAD_FOLDER):
+            st.session_state['uploaded_file'] = (uploaded_file.name, uploaded_file.size)
             st.success(f"File {uploaded_file.name} uploaded successfully!")
             file_size_mb = uploaded_file.size / (1024 * 1024)
             send_discord_notification(
@@ -3,8 +3,9 @@ import pandas as pd
 from PIL import Image, ImageDraw, ImageFont
 from io import BytesIO
 from streamlit_drawable_canvas import st_canvas
-from lib.aws import list_files_paginated, extract_first_frame, convert_lines_to_vectors, write_vectors_to_s3, send_discord_notification
-from lib.sagemaker_processing import run
+from lib.aws import list_files_indexed, extract_first_frame, convert_lines_to_vectors, write_vectors_to_s3, send_discord_notification
+from lib.sagemaker_processing import run, run_batch
+from lib.sharding import SHARDING_ENABLED
 import base64
 import cv2
 from collections import defaultdict
@@ -16,11 +17,6 @@ import requests
 def handle_click(direction, index):
     st.session_state[f"button_{index}"] = direction
 
-# Manage initial load and refresh with session state
-if 'vector_names' not in st.session_state:
-    names = list_files_paginated("jamar", "client_upload/", file_type='*')
-    st.session_state['vector_names'] = [name.split('/')[-1] for name in names]
-
 if 'names_to_vectors' not in st.session_state:
     st.session_state['names_to_vectors'] = defaultdict(list)
 
@@ -28,6 +24,12 @@ if 'names_to_vectors' not in st.session_state:
 def get_first_frame(video_name):
     return extract_first_frame("jamar", f"client_upload/{video_name}")
 
+def labeled_vectors():
+    v = {}
+    for i, (x1, y1, x2, y2) in enumerate(st.session_state['vectors']):
+        v[st.session_state.get(f'button_{i}')] = ((x1, y1), (x2, y2))
+    return v
+
 def base64_encode_image(frame):
     _, encoded_frame = cv2.imencode('.png', frame)
     return base64.b64encode(encoded_frame).decode('utf-8')
@@ -35,6 +37,13 @@ def base64_encode_image(frame):
 # Header
 st.header("Insight AI Job Submission")
 
+refresh = st.button('Refresh Videos', key='refresh_videos')
+
+# Manage initial load and refresh with session state
+if refresh or 'vector_names' not in st.session_state:
+    names = list_files_indexed("jamar", "client_upload/", file_type='*', force_refresh=refresh)
+    st.session_state['vector_names'] = [name.split('/')[-1] for name in names]
+
 st.markdown("""
 Welcome to the Insight AI Job Submission page. Follow the steps below to submit your video processing job:
 
@@ -144,15 +153,15 @@ st.markdown("""
 
 # Add checkbox for video output option
 write_video = st.checkbox("Include video output", value=True)
+# Only offered once the processing container supports time segments
+shard_long_videos = SHARDING_ENABLED and st.checkbox("Process long videos as parallel time segments", value=False)
 
 # Add a button to submit the job
 if st.button("Submit Job"):
     if 'vectors' in st.session_state and st.session_state['vectors']:
         file_type = st.session_state.get('bg_video_name').split('.')[-1]
 
-        v = {}
-        for i, (x1, y1, x2, y2) in enumerate(st.session_state['vectors']):
-            v[st.session_state.get(f'button_{i}')] = ((x1, y1), (x2, y2))
+        v = labeled_vectors()
 
         row = {
             "File Name": st.session_state.get("bg_video_name"),
@@ -164,22 +173,66 @@ if st.button("Submit Job"):
         #upsert_row_to_db(row)
         write_vectors_to_s3(v, "jamar", f'submissions/{st.session_state.get("bg_video_name").replace("." + file_type, "")}/vectors.txt')
 
-        run(st.session_state.get("bg_video_name"), write_video=write_video)
-        st.success("Job submitted successfully!")
-        
-        # Send Discord notification
-        send_discord_notification(
-            file_name=st.session_state.get("bg_video_name"),
-            title="New Job Submitted",
-            description=f"A new job has been submitted for the video {st.session_state.get('bg_video_name')}.",
-            color=3066993  # Discord green color
-        )
+        try:
+            submitted = run(st.session_state.get("bg_video_name"), write_video=write_video, shard=shard_long_videos)
+        except Exception as e:
+            submitted = None
+            st.error(f"Job submission failed: {e}")
+        else:
+            if submitted is None:
+                st.error("Job submission failed: no processing job could be started. Please try again later.")
+
+        if submitted is not None:
+            st.success("Job submitted successfully!")
+
+            # Send Discord notification
+            send_discord_notification(
+                file_name=st.session_state.get("bg_video_name"),
+                title="New Job Submitted",
+                description=f"A new job has been submitted for the video {st.session_state.get('bg_video_name')}.",
+                color=3066993  # Discord green color
+            )
     else:
         st.error("Please draw vectors and specify directions before submitting the job.")
 
+st.markdown("""
+5. **Batch Submission (optional)**:
+    - Select several videos to submit in one go.
+    - Either apply the vectors drawn above to every selected video, or reuse the vectors previously saved for each video.
+    - All videos are checked before any job is started, and a per-video summary is shown.
+""")
+
+batch_videos = st.multiselect("Videos to submit", st.session_state['vector_names'], key='batch_select')
+share_vectors = st.checkbox("Use the vectors drawn above for all selected videos (replaces their saved vectors)", value=False)
+
+if st.button("Submit Batch"):
+    if not batch_videos:
+        st.error("Please select at least one video to submit.")
+    elif share_vectors and not st.session_state.get('vectors'):
+        st.error("Please draw vectors and specify directions before submitting the batch.")
+    else:
+        with st.spinner(f"Submitting {len(batch_videos)} videos..."):
+            results = run_batch(batch_videos, write_video=write_video, vectors=labeled_vectors() if share_vectors else None)
+        results_df = pd.DataFrame(results)
+        submitted = results_df[results_df["Status"] == "Submitted"]
+
+        if len(submitted) == len(results_df):
+            st.success(f"All {len(submitted)} jobs submitted successfully!")
+        else:
+            st.warning(f"{len(submitted)} of {len(results_df)} jobs submitted. See the summary below for details.")
+        st.dataframe(results_df, hide_index=True)
+
+        if len(submitted):
+            send_discord_notification(
+                file_name=", ".join(submitted["File Name"]),
+                title="New Batch Submitted",
+                description=f"A batch of {len(submitted)} jobs has been submitted.",
+                color=3066993  # Discord green color
+            )
+
 # Link to check status
 st.markdown("""
-**5. Job Status**: Once the job is submitted, check the job status.
+**6. Job Status**: Once the job is submitted, check the job status.
 """)
 
 st.page_link(
@@ -1,62 +1,29 @@
-import boto3
-from sqlalchemy import create_engine, text
+import time
+
 import pandas as pd
 import streamlit as st
-import os
+from lib.aws import client_stats
+from lib.job_status import poll_job_page, STATUS_COLUMNS, TERMINAL_STATUSES
 
-region = 'us-east-2'
-access_key = os.getenv("AWS_ACCESS_KEY_ID")
-secret_key = os.getenv("AWS_SECRET_ACCESS_KEY")
-connection_string = os.getenv("POSTGRES_CONNECTION_STRING")
+# How often the visible page of the status table is re-read
+REFRESH_SECONDS = 30
+PAGE_SIZE = 25
+STATUS_OPTIONS = ['InProgress', 'Stopping'] + list(TERMINAL_STATUSES)
 
-def generate_presigned_url(object_s3_uri, expiration=3600):
-    s3_client = boto3.client('s3', region_name=region, aws_access_key_id=access_key, aws_secret_access_key=secret_key)
-    bucket_name, object_key = object_s3_uri.replace("s3://", "").split("/", 1)
+def get_s3_status(client, page=None, after=None, **filters):
     try:
-        response = s3_client.generate_presigned_url('get_object',
-                                                    Params={'Bucket': bucket_name, 'Key': object_key},
-                                                    ExpiresIn=expiration)
-    except Exception as e:
-        print(e)
-        return None
-    return response
-
-def get_s3_status(client):
-    try:
-        # Create the database engine
-        engine = create_engine(connection_string)
-        
-        # Define your query with a parameter placeholder for client
-        query = """
-        SELECT "File Name", "Start Time", "End Time", "Duration (hrs)", "Status", "Write Video", "Output Path"
-        FROM processing
-        WHERE "Client" = :client
-        ORDER BY "Start Time" DESC;
-        """
-
-        # Execute the query and fetch the data into a DataFrame
-        with engine.connect() as connection:
-            result = connection.execute(text(query), {'client': client})
-            df = pd.DataFrame(result.fetchall(), columns=result.keys())
-        
-        # Generate download links for rows with Write Video == True and Status == Completed
-        df['Download Link'] = df.apply(
-            lambda row: generate_presigned_url(
-                f"{row['Output Path']}/{row['File Name'].replace('.mp4', '').replace('.h264', '')}_post_process_tracks.mp4"
-            ) if row['Write Video'] and row['Status'] == 'Completed' else None, axis=1
-        )
-        
-        # Select only the required columns for the final DataFrame
-        df = df[['File Name', 'Start Time', 'End Time', 'Duration (hrs)', 'Status', 'Download Link']]
-        
-        return df
+        return poll_job_page(client, page, PAGE_SIZE, after, **filters)
     except Exception as e:
         print(f"An error occurred: {e}")
-        return pd.DataFrame(columns=['File Name', 'Start Time', 'End Time', 'Duration (hrs)', 'Status', 'Download Link'])
+        return pd.DataFrame(columns=STATUS_COLUMNS), None, True
 
 def show_table_with_links(df):
-    df['Download Link'] = df['Download Link'].apply(lambda x: f'<a href="{x}" target="_blank">Download</a>' if x is not None else "")
-    st.write(df.to_html(escape=False, index=False), unsafe_allow_html=True)
+    st.dataframe(
+        df,
+        hide_index=True,
+        use_container_width=True,
+        column_config={"Download Link": st.column_config.LinkColumn("Download Link", display_text="Download")},
+    )
 
 st.set_page_config(page_title="Traffic Tracker - Processed Videos", layout="wide")
 
@@ -68,19 +35,60 @@ Welcome to the TraffMind AI Job Status page. Follow the steps below to check the
 **1. Download Video**: Use the main panel to download your processed videos.
 """)
 refresh = st.button('Refresh Data', key='refresh')
+col1, col2, col3 = st.columns(3)
+with col1:
+    statuses = st.multiselect("Status", STATUS_OPTIONS)
+with col2:
+    date_range = st.date_input("Start date", value=[])
+with col3:
+    name = st.text_input("File name contains")
 
-if 'first_load' not in st.session_state:
-    st.session_state['first_load'] = False
-    data_df = get_s3_status('Jamar')
+filters = {
+    'statuses': statuses,
+    'start_date': date_range[0] if len(date_range) > 0 else None,
+    'end_date': date_range[1] if len(date_range) > 1 else None,
+    'name': name.strip() or None,
+}
+# Cursors of the pages visited so far; the first page has none. New filters start over.
+if refresh or st.session_state.get('status_filters') != filters:
+    st.session_state['status_filters'] = filters
+    st.session_state['status_cursors'] = [None]
+    st.session_state['status_page'] = None
+
+@st.fragment(run_every=REFRESH_SECONDS)
+def job_status_table():
+    cursors = st.session_state['status_cursors']
+    start = time.perf_counter()
+    # Polls after the first only re-read jobs that can still change
+    data_df, page, changed = get_s3_status('Jamar', st.session_state['status_page'], cursors[-1],
+                                           **st.session_state['status_filters'])
+    load_ms = (time.perf_counter() - start) * 1000
+    st.session_state['status_page'] = page
+    next_cursor = page['next_cursor'] if page else None
+    if data_df.empty and len(cursors) == 1:
+        st.info("No jobs match. Submit a job, or change the filters, to view processed videos.")
+        return
     show_table_with_links(data_df)
 
-if refresh:
-    try:
-        data_df = get_s3_status('Jamar')
-        show_table_with_links(data_df)
-    except Exception as e:
-        st.error(f"No jobs have been submitted yet. Please submit a job to view processed videos.")
-        st.stop()
+    col1, col2, col3 = st.columns([1, 1, 4])
+    with col1:
+        if st.button("Previous", disabled=len(cursors) == 1):
+            cursors.pop()
+            st.session_state['status_page'] = None
+            st.rerun(scope="fragment")
+    with col2:
+        if st.button("Next", disabled=next_cursor is None):
+            cursors.append(next_cursor)
+            st.session_state['status_page'] = None
+            st.rerun(scope="fragment")
+    with col3:
+        st.caption(f"Page {len(cursors)}")
+
+    with st.expander("Connection stats"):
+        st.caption(f"This page of the table loaded in {load_ms:.0f} ms ({'re-read' if changed else 'unchanged since the last poll'})")
+        st.dataframe(pd.DataFrame([client_stats()]), hide_index=True)
+
+job_status_table()
 
 st.markdown("""
 **2. Get Job Counts**: Click the button below to view the reports of your submitted jobs.
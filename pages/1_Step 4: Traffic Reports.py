@@ -1,71 +1,136 @@
 import streamlit as st
-from lib.aws import list_files_paginated, download_file
-import pandas as pd
+from lib.aws import list_files_indexed
+from lib.reports import load_report, build_display_table, prefetch_recent_reports, CLASS_SCHEMES, detect_class_scheme, rebin_counts, peak_hour, approach_totals
+from lib.sharding import finalize_sharded_jobs
+from lib.export import EXPORT_FORMATS, export_reports, select_reports
+from lib.warehouse import GROUP_COLUMNS, aggregate_counts, ingest_new_reports, warehouse_sites
 
 # Set page configuration
 st.set_page_config(page_title="TraffMind AI Job Reports", layout="wide")
 
 st.header("TraffMind AI Job Reports")
 
+refresh = st.button('Refresh Reports', key='refresh')
+
 # Manage initial load and refresh with session state
-if 'first_load' not in st.session_state or 'names' not in st.session_state or 'name_to_key' not in st.session_state:
+if refresh or 'first_load' not in st.session_state or 'names' not in st.session_state or 'name_to_key' not in st.session_state:
     name_to_key = {}
-    names = list_files_paginated("jamar","outputs/", file_type='txt')
+    # Merge the segment reports of any sharded jobs that have finished
+    if finalize_sharded_jobs(list_files_indexed("jamar", "outputs/", force_refresh=refresh)):
+        refresh = True
+    names = list_files_indexed("jamar","outputs/", file_type='txt', force_refresh=refresh)
     # Get just file names
     name_to_key = {name.split('/')[-1]: name for name in names}
 
-    # Filter out keys that have 'crosswalk' in them
-    names = [name for name in names if 'crosswalk' not in name]
+    # Filter out keys that have 'crosswalk' in them, and per-segment reports of sharded jobs
+    names = [name for name in names if 'crosswalk' not in name and '/segment_' not in name]
 
     names = [name.split('/')[-1] for name in names]
     st.session_state['first_load'] = True
     st.session_state['names'] = names
     st.session_state['name_to_key'] = name_to_key
 
-refresh = st.button('Refresh Reports', key='refresh')
+    # Warm the report cache with the newest reports while the user picks one
+    prefetch_recent_reports("jamar", [name_to_key[name] for name in names])
 
 # Dropdown for selecting report file
 report_file_name = st.selectbox("Select a report file", st.session_state.get('names', []))
 
 if report_file_name:
-    # Download the file from S3
     if not st.session_state.get('name_to_key', False):
         st.rerun()
 
     key = st.session_state['name_to_key'][report_file_name]
-    download_file("jamar", key, report_file_name)
 
-    minute_increment = 15
-
-    report_file_path = report_file_name
     try:
-        with open(report_file_path, 'r') as f:
-            movement_dict_list = eval(f.readlines()[0])
-            # Remove empty dicts from list
-            movement_dict_list = [x for x in movement_dict_list if x]
-
-            rows = []
-
-            for i, movement_dict in enumerate(movement_dict_list):
-                for class_number in range(1, 7):
-                    if class_number == 1:
-                        row = {'From': f"{minute_increment * i} min", 'To': f"{minute_increment * (i + 1)} min",'class': class_number}
-                    else:
-                        row = {'From': '', 'To': '', 'class': class_number}
-                    for feature, counts_dict in movement_dict.items():
-                        row[feature] = counts_dict.get(class_number, 0)
-                    rows.append(row)
-            final_df = pd.DataFrame(rows)
-
-            # Convert NA to 0
-            final_df = final_df.fillna(0)
-            # Convert all columns except From and To to int
-            for col in final_df.columns:
-                if col not in ['From', 'To']:
-                    final_df[col] = final_df[col].astype(int)
-
-            n_rows = final_df.shape[0]
-
-            st.dataframe(final_df.style.hide(axis="index"), hide_index=True, height=int(35.2 * (n_rows + 1)), width=1000)
+        counts, minute_increment = load_report("jamar", key)
+
+        col1, col2 = st.columns(2)
+        with col1:
+            interval_options = [m for m in (15, 30, 60, 120) if m % minute_increment == 0] or [minute_increment]
+            interval = st.selectbox("Interval (minutes)", interval_options, index=0)
+        with col2:
+            schemes = list(CLASS_SCHEMES)
+            scheme = st.selectbox("Class scheme", schemes, index=schemes.index(detect_class_scheme(counts)))
+        classes = CLASS_SCHEMES[scheme]
+
+        peak = peak_hour(counts, minute_increment)
+        if peak:
+            st.metric("Peak hour", f"{peak['start']}-{peak['end']} min", f"{peak['total']} vehicles", delta_color="off")
+
+        final_df = build_display_table(rebin_counts(counts, minute_increment, interval), interval, classes)
+
+        n_rows = final_df.shape[0]
+
+        st.dataframe(final_df.style.hide(axis="index"), hide_index=True, height=int(35.2 * (n_rows + 1)), width=1000)
+
+        st.markdown("**Totals by approach**")
+        st.dataframe(approach_totals(counts, classes), hide_index=True)
     except Exception as e:
         st.error(f"Error loading report file: {e}")
+
+with st.expander("Bulk export"):
+    st.markdown("""
+    Export many reports at once. Pick reports by name, or leave the list empty and choose a date range.
+    """)
+    export_names = st.multiselect("Reports", st.session_state.get('names', []), key='export_names')
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        use_dates = st.checkbox("Filter by date", value=not export_names)
+    with col2:
+        date_range = st.date_input("Report dates", value=[], disabled=not use_dates)
+    with col3:
+        export_format = st.radio("Format", EXPORT_FORMATS, horizontal=True)
+
+    if st.button("Export Reports"):
+        name_to_key = st.session_state.get('name_to_key', {})
+        names = export_names or st.session_state.get('names', [])
+        keys = [name_to_key[name] for name in names]
+        if use_dates and len(date_range) == 2:
+            keys = select_reports("jamar", keys, date_range[0], date_range[1])
+        if not keys:
+            st.error("No reports match the selection.")
+        else:
+            progress_bar = st.progress(0.0, text=f"Exporting {len(keys)} reports...")
+            try:
+                url = export_reports(
+                    "jamar", keys, export_format,
+                    progress_callback=lambda done, total: progress_bar.progress(done / total, text=f"Exported {done} of {total} reports"),
+                )
+                st.link_button("Download export", url)
+            except Exception as e:
+                st.error(f"Export failed: {e}")
+
+with st.expander("Cross-job totals"):
+    st.markdown("""
+    Totals summed across many reports from the counts warehouse. Leave the lists empty to include every ingested report and site.
+    """)
+    if st.button("Ingest new reports"):
+        name_to_key = st.session_state.get('name_to_key', {})
+        with st.spinner("Loading reports into the warehouse..."):
+            try:
+                ingested = ingest_new_reports("jamar", [name_to_key[name] for name in st.session_state.get('names', [])])
+                st.success(f"Ingested {len(ingested)} new or updated reports.")
+            except Exception as e:
+                st.error(f"Ingest failed: {e}")
+
+    warehouse_names = st.multiselect("Reports", st.session_state.get('names', []), key='warehouse_names')
+    try:
+        sites = warehouse_sites()
+    except Exception:
+        sites = []
+    warehouse_sites_selected = st.multiselect("Sites", sites, key='warehouse_sites')
+    warehouse_dates = st.date_input("Interval dates", value=[], key='warehouse_dates')
+    group_by = st.multiselect("Group by", GROUP_COLUMNS, default=["movement", "class"])
+    if group_by and st.button("Run query"):
+        name_to_key = st.session_state.get('name_to_key', {})
+        try:
+            totals = aggregate_counts(
+                [name_to_key[name] for name in warehouse_names] or None, group_by,
+                sites=warehouse_sites_selected or None,
+                start_date=warehouse_dates[0] if len(warehouse_dates) > 0 else None,
+                end_date=warehouse_dates[1] if len(warehouse_dates) > 1 else None,
+            )
+            st.dataframe(totals, hide_index=True)
+        except Exception as e:
+            st.error(f"Query failed: {e}")
@@ -1,26 +1,42 @@
 import streamlit as st
-from PIL import Image
-from lib import download_file, list_files
+from lib.backgrounds import background_index, get_background, thumbnail_urls
 
 st.set_page_config(layout="wide")
 
-# Simulated mapping of submission names to background image files.
-# Replace these with your actual data.
-
 bucket = "traffmind-client-processed-jamar-dev"
 
-# Example list of processed videos - this list is empty to simulate the current situation
-background_images = list_files(bucket, '*', 'png')  # Update this with actual processed videos once available
+# Thumbnails shown at first, and added each time "Show more" is clicked
+GALLERY_PAGE_SIZE = 12
+GALLERY_COLUMNS = 4
+
+refresh = st.button('Refresh Backgrounds', key='refresh')
+# Only job outputs are indexed; the listing is shared and re-walked at most once per TTL
+background_images = background_index(bucket, force_refresh=refresh)
+entry_by_key = {entry["Key"]: entry for entry in background_images}
 
 # Introduction and user guidance
 st.markdown("""
 Explore the power of our background detection technology. This feature allows you to see the extracted background from your previously submitted videos. Here’s how to view your backgrounds:
 """)
 st.markdown("""
-1. **Select Your Submission**: Use the dropdown menu in the side panel to select one of your previous submissions.
+1. **Select Your Submission**: Browse the gallery below, or use the dropdown menu to select one of your previous submissions.
 """)
 
-selected_submission = st.selectbox("Previous Submissions", options=background_images)
+shown = st.session_state.setdefault('gallery_count', GALLERY_PAGE_SIZE)
+visible = background_images[:shown]
+if visible:
+    columns = st.columns(GALLERY_COLUMNS)
+    for i, (entry, url) in enumerate(zip(visible, thumbnail_urls(bucket, visible))):
+        with columns[i % GALLERY_COLUMNS]:
+            if url:
+                st.image(url, caption=entry["Key"], use_column_width=True)
+            else:
+                st.caption(f"{entry['Key']} (no preview)")
+    if shown < len(background_images) and st.button("Show more"):
+        st.session_state['gallery_count'] = shown + GALLERY_PAGE_SIZE
+        st.rerun()
+
+selected_submission = st.selectbox("Previous Submissions", options=list(entry_by_key))
 
 # Main panel for displaying the background image
 st.header("Extracted Background Image")
@@ -29,21 +45,12 @@ st.markdown("""
 2. **View the Background**: The extracted background image from your selected video will be displayed in the main panel.
 """)
 
-# if video selected, display download button, if clicked, download the video
-if background_images:
-    if selected_submission:
-        file_name = selected_submission.split("/")[-1]
-        download_file(bucket, file_name, selected_submission)
-        with open(file_name, "rb") as file:
-            print(f'reading file {file_name}')
-            file_bytes = file.read()
-
-        st.download_button(label="Click here to download the background image", data=file_bytes, file_name=selected_submission)
-
-
-try:
-
-    # Attempt to display the background image
-    st.image(file_name, caption=f"Background for {selected_submission}", use_column_width=True)
-except Exception as e:
-    st.error("The background image for this submission is currently unavailable.")
+if selected_submission:
+    try:
+        # Full images are kept in memory, so switching back and forth doesn't re-download
+        file_bytes = get_background(bucket, entry_by_key[selected_submission])
+        st.download_button(label="Click here to download the background image", data=file_bytes,
+                           file_name=selected_submission.split("/")[-1])
+        st.image(file_bytes, caption=f"Background for {selected_submission}", use_column_width=True)
+    except Exception as e:
+        st.error("The background image for this submission is currently unavailable.")
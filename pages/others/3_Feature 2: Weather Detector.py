@@ -1,48 +1,10 @@
-import os
+import pandas as pd
 import streamlit as st 
-from PIL import Image, ImageOps
-import numpy as np
-from io import BytesIO
-import tensorflow as tf
-import cv2
+from PIL import Image
+from lib.aws import list_files_indexed
+from lib.sagemaker_processing import SUPPORTED_VIDEO_TYPES
+from lib.weather import get_weather_model, predict_weather, open_uploaded_images, s3_weather_timeline
 
-# Function to preprocess the image for the model
-def preprocess_image_for_prediction(image):
-    # Read the image in grayscale mode
-    temp_image = np.array(image.convert('L'))
-    edges = cv2.Canny(temp_image, 150, 300)
-    shape = np.shape(edges)
-    left = np.sum(edges[0:shape[0] // 2, 0:shape[1] // 2])
-    right = np.sum(edges[0:shape[0] // 2, shape[1] // 2:])
-
-    if right > left:
-        sky_side = 0
-    else:
-        sky_side = 1
-
-    base_height = 400
-    wpercent = (base_height / float(image.size[1]))
-    wsize = int((float(image.size[0]) * float(wpercent)))
-    image = image.resize((wsize, base_height), Image.Resampling.LANCZOS)
-    
-    if image.size[0] >= image.size[1]:
-        if sky_side == 0:
-            image = image.crop((0, 0, base_height, image.size[1]))
-        else:
-            image = image.crop((image.size[0] - base_height, 0, image.size[0], image.size[1]))
-    else:
-        base_width = 400
-        wpercent = (base_width / float(image.size[0]))
-        hsize = int((float(image.size[1]) * float(wpercent)))
-        image = image.resize((base_width, hsize), Image.Resampling.LANCZOS)
-        image = image.crop((0, 0, image.size[0], 400))
-
-    image = ImageOps.invert(image)
-    image = image.resize((100, 100), Image.Resampling.LANCZOS)
-    img_array = np.array(image) / 255.0
-    img_array = np.expand_dims(img_array, axis=0)
-
-    return img_array
 def app():
     st.set_page_config(page_title="Keras Prediction Interface", layout="wide")
     
@@ -53,6 +15,10 @@ def app():
     **Welcome to the TraffMind AI Image Classifier!** This tool uses advanced neural networks to predict weather conditions from images. For best accuracy, please use images that include a portion of the sky. Follow the steps below to upload your image and receive predictions:
     """)
     
+    # Loaded once per process and shared by every session
+    with st.spinner("Loading model..."):
+        get_weather_model()
+
     # Step 1: Upload Image
     st.markdown("""
     **1. Upload Image**: Drag and drop or select an image file for prediction. Supported format: JPEG.
@@ -71,15 +37,45 @@ def app():
             """)
             image = Image.open(uploaded_file)
             st.write("Identifying...")
-            preprocessed_image = preprocess_image_for_prediction(image)
-            model_path = "./model/traffmind_weather_beta1.h5"
-            loaded_model = tf.keras.models.load_model(model_path)
-            predictions = loaded_model.predict(preprocessed_image)
-            classes = ['Cloudy', 'Sunny', 'Rainy', 'Snowy', 'Foggy']
-            prediction = classes[np.argmax(predictions)]
+            results, _ = predict_weather([image])
+            prediction = results[0]["prediction"]
             st.write('Prediction: %s' % (prediction))
             st.image(image, caption='Uploaded Image.', use_column_width=False)
 
+    st.markdown("""
+    **Batch Mode (optional)**: Upload many images, or zip files of images, to classify them all at once.
+    """)
+    batch_files = st.file_uploader("Choose images or zip files...", type=["jpg", "jpeg", "png", "zip"], accept_multiple_files=True)
+    if batch_files and st.button('Identify All', key='identify_all'):
+        try:
+            names, images = zip(*open_uploaded_images(batch_files))
+        except ValueError:
+            st.error("No images found in the uploaded files.")
+            return
+        with st.spinner(f"Identifying {len(images)} images..."):
+            results, stats = predict_weather(list(images))
+        st.write(f"Classified {stats['images']} images in {stats['preprocess_seconds'] + stats['predict_seconds']:.2f}s "
+                 f"({stats['images_per_second']:.1f} images/s; preprocessing {stats['preprocess_seconds']:.2f}s, "
+                 f"inference {stats['predict_seconds']:.2f}s)")
+        results_df = pd.DataFrame({"Image": names, "Prediction": [r["prediction"] for r in results],
+                                   "Confidence": [r["confidence"] for r in results]})
+        st.dataframe(results_df, hide_index=True)
+
+    st.markdown("""
+    **Video Timeline (optional)**: Pick an uploaded video to get the weather for each count interval, matching the intervals of its traffic report.
+    """)
+    videos = list_files_indexed("jamar", "client_upload/", file_type=SUPPORTED_VIDEO_TYPES)
+    video_key = st.selectbox("Video", videos, format_func=lambda key: key.split('/')[-1])
+    interval = st.selectbox("Interval (minutes)", [15, 30, 60], index=0)
+    if video_key and st.button('Build Timeline', key='timeline'):
+        with st.spinner("Sampling one frame per interval..."):
+            try:
+                timeline = s3_weather_timeline("jamar", video_key, interval)
+            except Exception as e:
+                st.error(f"Could not read the video: {e}")
+                return
+        st.dataframe(timeline.drop(columns="interval"), hide_index=True)
+
 
 if __name__=='__main__':
     app()
@@ -1,44 +1,24 @@
 import streamlit as st
 from PIL import Image, ImageDraw
 import numpy as np
-import torch
-from torchvision import transforms
+import pandas as pd
 import cv2
-from ultralytics import RTDETR, YOLO
 import supervision as sv
-from lib import download_file
+from lib.models import model_stats
+from lib.vehicles import classify_crops, default_device, detect, get_classifier
 import openai
 import os
 import base64
 import requests
 
-device = 'cuda' if torch.cuda.is_available() else 'cpu'
+device = default_device()
 
 # Set your OpenAI API key
 openai_api_key = os.getenv("OPENAI_API_KEY")
 client = openai.Client(api_key=openai_api_key)
 
-# Download the model file
-download_file('traffmind-models', 'rtdetr-l.pt', 'rtdetr-l.pt', region='us-east-1')
-
-# Load the original classification model
-class_model_path = './model/yolov8-cls.yaml'
-check_point_dir = './model/yolov8n-cls-20240508-002451.pt'
-
-state_dict = torch.load(check_point_dir, map_location=device)
-class_model = YOLO(class_model_path)  # Assuming YOLO is a class you have defined or imported
-class_model = class_model.model.model
-class_model.to(device)
-class_model.eval()
-class_model.load_state_dict(state_dict)
-
-# Transform and color map
-size = 256
-transform = transforms.Compose([
-    transforms.Resize((size, size)),
-    transforms.ToTensor(),
-    transforms.Normalize([0.485, 0.456, 0.406], [0.229, 0.224, 0.225]),
-])
+# Classifier output labels and color map
+classifier_classes = [str(i) for i in range(13)]
 color_map = {
     'bin 1': 'red',
     'bin 2': 'blue',
@@ -55,16 +35,6 @@ color_map = {
     'bin 13': 'maroon'
 }
 
-def get_class_of_cropped_frame(cropped_frame, model, device):
-    pil_image = Image.fromarray(cropped_frame)
-    image_tensor = transform(pil_image).unsqueeze(0).to(device)
-    with torch.no_grad():
-        predictions = model(image_tensor)
-    classes = [str(i) for i in range(13)]
-    top_class_idx = torch.argmax(predictions, dim=1).item()
-    top_class = classes[top_class_idx]
-    return top_class
-
 # Utility function to convert OpenCV image to base64
 def cv2_to_base64(image):
     _, buffer = cv2.imencode('.jpg', image)
@@ -161,25 +131,23 @@ def detect_objects_and_classify_model_a(image):
     original_frame = frame.copy()
     frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
 
-    # Load the model and perform detection
-    model = RTDETR('rtdetr-l.pt')  # Path to your model
-    results = model(frame)[0]
+    # Shared detector, loaded once per process and run one frame at a time
+    results = detect(frame, device=device)
     detections = sv.Detections.from_ultralytics(results)
 
     # Filter detections and convert to PIL
     detections = detections[(detections['class_name'] == 'car') | (detections['class_name'] == 'truck') | (detections['class_name'] == 'bus') | (detections['class_name'] == 'motorcycle')]
     detections = detections[(detections.confidence > 0.6)]
     
-    class_results = []
-    for i in range(len(detections.xyxy)):
-        det = detections.xyxy[i]
-        x1, y1, x2, y2 = map(int, det)  # Convert coordinates to integers
-        cropped_frame = frame[y1:y2, x1:x2]
-        if detections.data['class_name'][i] == 'motorcycle':
-            result = '1'  # Bin 1 for motorcycles
-        else:
-            result = get_class_of_cropped_frame(cropped_frame, class_model, device)
-        class_results.append(result)
+    # Motorcycles are bin 1; every other crop is classified in one batched pass
+    class_results = ['1'] * len(detections.xyxy)
+    to_classify = [i for i in range(len(detections.xyxy)) if detections.data['class_name'][i] != 'motorcycle']
+    crops = []
+    for i in to_classify:
+        x1, y1, x2, y2 = map(int, detections.xyxy[i])  # Convert coordinates to integers
+        crops.append(frame[y1:y2, x1:x2])
+    for i, result in zip(to_classify, classify_crops(crops, classifier_classes, get_classifier(device=device), device)):
+        class_results[i] = result
 
     pil_frame = apply_detections_to_frame(original_frame, detections, class_results, 'Model A')
     
@@ -191,9 +159,8 @@ def detect_objects_and_classify_model_b(image):
     original_frame = frame.copy()
     frame = cv2.cvtColor(frame, cv2.COLOR_RGB2BGR)
 
-    # Load the model and perform detection
-    model = RTDETR('rtdetr-l.pt')  # Path to your model
-    results = model(frame)[0]
+    # Shared detector, loaded once per process and run one frame at a time
+    results = detect(frame, device=device)
     detections = sv.Detections.from_ultralytics(results)
 
     # Filter detections and convert to PIL
@@ -262,5 +229,10 @@ def app():
             with col2:
                 st.image(processed_image_b, caption='Model B: Detected Vehicles', use_column_width=True)
 
+            with st.expander("Loaded models"):
+                st.dataframe(pd.DataFrame([{"Model": " / ".join(key), "Load time (s)": round(stats["load_seconds"], 2),
+                                            "Memory (MB)": round((stats["memory_bytes"] or 0) / 2**20, 1)}
+                                           for key, stats in model_stats().items()]), hide_index=True)
+
 if __name__ == '__main__':
     app()